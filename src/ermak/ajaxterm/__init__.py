@@ -13,7 +13,27 @@ vnc_opts = [
              '"http://127.0.0.1:8022/"'),
     cfg.StrOpt('ajaxterm_portrange',
         default='10000-12000',
-        help='Range of ports that ajaxterm should try to bind')
+        help='Range of ports that ajaxterm should try to bind'),
+    cfg.StrOpt('websocket_console_base_url',
+        default='ws://127.0.0.1:8022/websocket',
+        help='location of WebSocket console endpoint of AjaxTerm console '
+             'proxy, in the form "ws://127.0.0.1:8022/websocket"'),
+    cfg.BoolOpt('ajaxterm_gateway',
+        default=True,
+        help='Serve all consoles of the host from one in-process gateway '
+             'instead of ajaxterm process per console'),
+    cfg.StrOpt('ajaxterm_gateway_host',
+        default='0.0.0.0',
+        help='Address that the console gateway should bind to'),
+    cfg.IntOpt('ajaxterm_gateway_port',
+        default=8023,
+        help='Port that the console gateway should bind to'),
+    cfg.StrOpt('ajaxterm_static_path',
+        default='/usr/share/ajaxterm',
+        help='Directory with ajaxterm HTML and JavaScript files'),
+    cfg.IntOpt('ajaxterm_session_timeout',
+        default=120,
+        help='Seconds after which unused console session is closed'),
 ]
 
 FLAGS = flags.FLAGS
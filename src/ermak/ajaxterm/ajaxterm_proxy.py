@@ -19,11 +19,13 @@
 
 """Eventlet WSGI Service to proxy VNC for XCP protocol."""
 
-from urllib2 import URLError
-from urlparse import urlparse, parse_qs, urlunparse
+import socket
+from urlparse import urlparse, parse_qs
 import webob
 
-from eventlet.green import urllib2
+import eventlet
+from eventlet.green import httplib
+from eventlet import wsgi as eventlet_wsgi
 
 from nova import context
 from nova import flags
@@ -34,6 +36,10 @@ from nova.openstack.common import rpc
 from nova import version
 from nova import wsgi
 
+from ermak.ajaxterm.upstream import UpstreamPool
+from ermak.util.cache import TTLCache
+from ermak.util.metrics import METRICS
+
 
 LOG = logging.getLogger("nova.ajaxterm.ajaxterm_proxy")
 
@@ -44,6 +50,24 @@ ajaxterm_proxy_opts = [
     cfg.StrOpt('ajaxterm_proxy_host',
         default='0.0.0.0',
         help='Address that the AjaxTerm console proxy should bind to'),
+    cfg.IntOpt('ajaxterm_token_cache_size',
+        default=1024,
+        help='Number of console tokens remembered by the proxy'),
+    cfg.IntOpt('ajaxterm_token_cache_ttl',
+        default=60,
+        help='Seconds a validated console token is trusted without '
+             'asking consoleauth again'),
+    cfg.IntOpt('ajaxterm_token_negative_ttl',
+        default=5,
+        help='Seconds an invalid console token is rejected without '
+             'asking consoleauth again'),
+    cfg.IntOpt('ajaxterm_upstream_connections',
+        default=4,
+        help='Idle keep-alive connections kept to each compute host'),
+    cfg.StrOpt('ajaxterm_proxy_metrics_file',
+        default='$state_path/ajaxterm-proxy-metrics.json',
+        help='Where token cache and upstream stats are written on '
+             'SIGUSR2'),
     ]
 
 FLAGS = flags.FLAGS
@@ -54,12 +78,87 @@ flags.DECLARE('consoleauth_topic', 'nova.consoleauth')
 def token_from_url(url):
     return parse_qs(urlparse(url).query).get('token')[0]
 
+
+def _pump(source, target):
+    """Copy data from source socket to target until source is closed"""
+    try:
+        while True:
+            data = source.recv(16 * 1024)
+            if not data:
+                break
+            target.sendall(data)
+    except socket.error:
+        pass
+    finally:
+        try:
+            target.shutdown(socket.SHUT_WR)
+        except socket.error:
+            pass
+
+
 class AjaxTermConsoleProxy(object):
     """Class to use the ajaxterm protocol to proxy ajaxterm consoles."""
 
     def __init__(self):
         self._consoleauth = rpcapi.ConsoleAuthAPI()
-        self._tokens = {}
+        self._tokens = TTLCache(FLAGS.ajaxterm_token_cache_size,
+                                FLAGS.ajaxterm_token_cache_ttl)
+        self.token_hits = 0
+        self.token_rpcs = 0
+        self._upstreams = UpstreamPool(FLAGS.ajaxterm_upstream_connections)
+
+    def _check_token(self, token):
+        """Connect info for token, cached for valid and invalid ones"""
+        if token in self._tokens:
+            self.token_hits += 1
+            return self._tokens.get(token)
+        self.token_rpcs += 1
+        ctxt = context.get_admin_context()
+        connect_info = self._consoleauth.check_token(ctxt, token)
+        if connect_info:
+            self._tokens.set(token, connect_info)
+        else:
+            self._tokens.set(token, None,
+                             ttl=FLAGS.ajaxterm_token_negative_ttl)
+        LOG.debug(_("Token cache: %s"), self.token_stats())
+        return connect_info
+
+    def token_stats(self):
+        lookups = self.token_hits + self.token_rpcs
+        hit_rate = float(self.token_hits) / lookups if lookups else 0.0
+        return {'hits': self.token_hits,
+                'rpcs': self.token_rpcs,
+                'rpcs_saved': self.token_hits,
+                'hit_rate': hit_rate,
+                'size': len(self._tokens)}
+
+    def upstream_stats(self):
+        """Requests, errors and latency of each compute host"""
+        return self._upstreams.stats_dict()
+
+    def _splice(self, environ, connect_info, remote_path):
+        """
+        Pass WebSocket upgrade request to compute host and join client and
+        compute host sockets, so frames go through untouched.
+        """
+        host, port = connect_info['host'], int(connect_info['port'])
+        lines = ["GET %s HTTP/1.1" % remote_path,
+                 "Host: %s:%s" % (host, port)]
+        for name, value in environ.iteritems():
+            if name.startswith('HTTP_') and name != 'HTTP_HOST':
+                lines.append("%s: %s" % (
+                    name[5:].replace('_', '-').title(), value))
+        client = environ['eventlet.input'].get_socket()
+        upstream = eventlet.connect((host, port))
+        try:
+            upstream.sendall("\r\n".join(lines) + "\r\n\r\n")
+            pumps = [eventlet.spawn(_pump, client, upstream),
+                     eventlet.spawn(_pump, upstream, client)]
+            for pump in pumps:
+                pump.wait()
+        finally:
+            upstream.close()
+        return eventlet_wsgi.ALREADY_HANDLED
 
     def __call__(self, environ, start_response):
         try:
@@ -73,10 +172,7 @@ class AjaxTermConsoleProxy(object):
                     [('content-type', 'text/html')])
                 return "Invalid Request"
 
-            ctxt = context.get_admin_context()
-            connect_info = self._tokens.get(token)
-            if not connect_info:
-                connect_info =  self._consoleauth.check_token(ctxt, token)
+            connect_info = self._check_token(token)
 
             if not connect_info:
                 LOG.audit(_("Request made with invalid token: %s"), req)
@@ -90,19 +186,31 @@ class AjaxTermConsoleProxy(object):
             #query_string = urlencode(query)
 
             query_string = req.query_string + "&token=" + token
-            remote_url = urlunparse(
-                ["http", "%(host)s:%(port)s" % connect_info,
-                 req.path, "",
-                 query_string, ""])
-
-            LOG.audit("Proxying request with remote url %s" % remote_url)
+            # console gateway routes requests by key in path prefix
+            path = req.path
+            if connect_info.get('internal_access_path'):
+                path = "/%s%s" % (
+                    connect_info['internal_access_path'].strip('/'), path)
+            remote_path = "%s?%s" % (path, query_string)
+            headers = {}
+            if req.content_type:
+                headers['Content-Type'] = req.content_type
+
+            if environ.get('HTTP_UPGRADE', '').lower() == 'websocket':
+                return self._splice(environ, connect_info, remote_path)
+
+            LOG.debug("Proxying request to %s:%s%s" % (
+                connect_info['host'], connect_info['port'], remote_path))
             try:
-                data = urllib2.urlopen(remote_url, req.body)
-                start_response(str(data.getcode()), data.info().items())
-                return data.read()
-            except URLError:
-                start_response('500 Server error')
+                status, response_headers, body = self._upstreams.request(
+                    connect_info['host'], connect_info['port'],
+                    req.method, remote_path, req.body or None, headers)
+            except (socket.error, httplib.HTTPException):
+                start_response('500 Server error',
+                    [('content-type', 'text/html')])
                 return "Can not open connection to compute host"
+            start_response(status, response_headers)
+            return body
         except Exception as e:
             LOG.audit(_("Unexpected error: %s"), e)
 
@@ -111,7 +219,11 @@ def get_wsgi_server():
     LOG.audit(_("Starting nova-ajaxterm-proxy node (version %s)"),
         version.version_string_with_vcs())
 
+    proxy = AjaxTermConsoleProxy()
+    METRICS.add_source('proxy.tokens', proxy.token_stats)
+    METRICS.add_source('proxy.upstreams', proxy.upstream_stats)
+    METRICS.dump_on_signal(FLAGS.ajaxterm_proxy_metrics_file)
     return  wsgi.Server("AjaxTerm console proxy",
-        AjaxTermConsoleProxy(),
+        proxy,
         host=FLAGS.ajaxterm_proxy_host,
         port=FLAGS.ajaxterm_proxy_port)
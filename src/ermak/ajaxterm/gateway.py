@@ -0,0 +1,193 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""
+Console gateway: serves ajaxterm protocol and WebSocket consoles for all
+router consoles of the host from one eventlet WSGI server, instead of
+ajaxterm process per console.
+"""
+
+import mimetypes
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+import eventlet
+from eventlet import websocket
+import webob
+
+from nova import flags
+from nova.openstack.common import log as logging
+from nova import wsgi
+
+from ermak import ajaxterm
+from ermak.ajaxterm.terminal import Terminal
+
+LOG = logging.getLogger("nova.ajaxterm.gateway")
+
+FLAGS = flags.FLAGS
+
+IDEM = '<?xml version="1.0"?><idem></idem>'
+# viewers of one console remembered for sending unchanged screen as idem
+MAX_VIEWERS = 16
+# let console echo typed keys before screen is dumped
+ECHO_WAIT = 0.01
+
+
+class ConsoleSession(object):
+    """Screen of router console, shared by all its viewers"""
+
+    def __init__(self, tap):
+        self.tap = tap
+        self.terminal = Terminal()
+        self.last_used = time.time()
+        self._dumps = OrderedDict()
+        # show what console printed before the session was opened
+        self.terminal.write(tap.output())
+        tap.subscribe(self.terminal.write)
+
+    def update(self, viewer, keys='', width=None, height=None):
+        """Send keys, return screen for viewer or IDEM if it is unchanged"""
+        self.last_used = time.time()
+        if width and height:
+            self.terminal.resize(width, height)
+        if keys and self.tap.send(keys):
+            eventlet.sleep(ECHO_WAIT)
+        dump = self.terminal.dump_html()
+        if self._dumps.pop(viewer, None) == dump:
+            self._dumps[viewer] = dump
+            return IDEM
+        self._dumps[viewer] = dump
+        if len(self._dumps) > MAX_VIEWERS:
+            self._dumps.popitem(last=False)
+        return dump
+
+    def close(self):
+        self.tap.unsubscribe(self.terminal.write)
+
+
+class ConsoleGateway(object):
+    """
+    WSGI application routing /<key>/... requests to router consoles.
+
+    Routing keys are given out by register(); nova console proxy puts
+    the key from internal_access_path in front of request path.
+    /<key>/websocket bridges WebSocket messages to the console. Consoles
+    are reached through their taps, so the gateway does not open
+    connections of its own.
+    """
+
+    def __init__(self, static_path, session_timeout):
+        self._static_path = static_path
+        self._session_timeout = session_timeout
+        self._routes = {}
+        self._sessions = {}
+        self._server = None
+        self._reaper = None
+        self._websocket = websocket.WebSocketWSGI(self._bridge)
+
+    def register(self, tap, key=None):
+        """Route console of given tap, return its routing key"""
+        if key is None:
+            key = uuid.uuid4().hex
+        if self._routes.get(key) is not tap:
+            self.close_session(key)
+        self._routes[key] = tap
+        return key
+
+    def unregister(self, key):
+        self._routes.pop(key, None)
+        self.close_session(key)
+
+    def close_session(self, key):
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def start(self, host, port):
+        self._server = wsgi.Server("Console gateway", self,
+                                   host=host, port=port)
+        self._server.start()
+        self._reaper = eventlet.spawn(self._reap)
+
+    def stop(self):
+        if self._reaper is not None:
+            self._reaper.kill()
+        if self._server is not None:
+            self._server.stop()
+        for key in self._sessions.keys():
+            self.close_session(key)
+
+    def _reap(self):
+        while True:
+            eventlet.sleep(self._session_timeout / 4.0)
+            deadline = time.time() - self._session_timeout
+            for key, session in self._sessions.items():
+                if session.last_used < deadline:
+                    LOG.debug("Closing idle console session %s" % key)
+                    self.close_session(key)
+
+    def _session(self, key):
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = ConsoleSession(self._routes[key])
+        return session
+
+    def __call__(self, environ, start_response):
+        req = webob.Request(environ)
+        key, _sep, name = req.path_info.lstrip('/').partition('/')
+        if key not in self._routes:
+            start_response('404 Not Found', [('content-type', 'text/html')])
+            return "Unknown console"
+        if name == 'u':
+            return self._update(key, req, start_response)
+        if name == 'websocket':
+            environ['ermak.console_tap'] = self._routes[key]
+            return self._websocket(environ, start_response)
+        return self._static(name or 'ajaxterm.html', start_response)
+
+    def _update(self, key, req, start_response):
+        params = req.params
+        try:
+            width = int(params.get('w', 0))
+            height = int(params.get('h', 0))
+        except ValueError:
+            width = height = 0
+        keys = params.get('k', u'').encode('latin-1', 'replace')
+        dump = self._session(key).update(
+            params.get('s', ''), keys, width, height)
+        start_response('200 OK', [('content-type', 'text/xml'),
+                                  ('cache-control', 'no-cache')])
+        return dump
+
+    def _bridge(self, ws):
+        """Relay console output to WebSocket and its messages back"""
+        tap = ws.environ['ermak.console_tap']
+
+        def send(data):
+            ws.send(data.decode('latin-1'))
+
+        send(tap.output())
+        tap.subscribe(send)
+        try:
+            while True:
+                message = ws.wait()
+                if message is None:
+                    break
+                if isinstance(message, unicode):
+                    message = message.encode('latin-1', 'replace')
+                tap.send(message)
+        finally:
+            tap.unsubscribe(send)
+
+    def _static(self, name, start_response):
+        path = os.path.join(self._static_path, os.path.basename(name))
+        if not os.path.isfile(path):
+            start_response('404 Not Found', [('content-type', 'text/html')])
+            return "Not found"
+        content_type = mimetypes.guess_type(path)[0] or \
+            'application/octet-stream'
+        with open(path, 'rb') as f:
+            data = f.read()
+        start_response('200 OK', [('content-type', content_type)])
+        return data
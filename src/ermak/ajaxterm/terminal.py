@@ -0,0 +1,134 @@
+"""Minimal VT100 screen for rendering router consoles in ajaxterm."""
+
+import cgi
+
+ESC = '\x1b'
+
+
+class Terminal(object):
+    """
+    Screen of width x height characters fed with console output.
+
+    Understands what IOS and ROMMON consoles use: line control
+    characters and CSI cursor movement and erase sequences. Other escape
+    sequences are dropped.
+    """
+
+    def __init__(self, width=80, height=25):
+        self.width = width
+        self.height = height
+        self._lines = [[' '] * width for _ in xrange(height)]
+        self.cx = 0
+        self.cy = 0
+        self._escape = None
+
+    def resize(self, width, height):
+        if (width, height) == (self.width, self.height):
+            return
+        lines = self._lines[-height:]
+        lines = [(line + [' '] * width)[:width] for line in lines]
+        while len(lines) < height:
+            lines.append([' '] * width)
+        self.cy = max(0, min(height - 1, self.cy - (self.height - height)))
+        self.cx = min(width - 1, self.cx)
+        self._lines = lines
+        self.width, self.height = width, height
+
+    def write(self, data):
+        for ch in data:
+            if self._escape is not None:
+                self._feed_escape(ch)
+            elif ch == ESC:
+                self._escape = ''
+            elif ch >= ' ' and ch != '\x7f':
+                self._put(ch)
+            elif ch == '\r':
+                self.cx = 0
+            elif ch == '\n':
+                self._newline()
+            elif ch == '\b':
+                self.cx = max(0, self.cx - 1)
+            elif ch == '\t':
+                self.cx = min(self.width - 1, (self.cx / 8 + 1) * 8)
+
+    def _put(self, ch):
+        if self.cx >= self.width:
+            self.cx = 0
+            self._newline()
+        self._lines[self.cy][self.cx] = ch
+        self.cx += 1
+
+    def _newline(self):
+        if self.cy == self.height - 1:
+            del self._lines[0]
+            self._lines.append([' '] * self.width)
+        else:
+            self.cy += 1
+
+    def _feed_escape(self, ch):
+        seq = self._escape + ch
+        if seq == '[' or (seq.startswith('[') and not ch.isalpha()):
+            self._escape = seq
+            return
+        self._escape = None
+        if seq.startswith('['):
+            self._csi(seq[1:-1], ch)
+
+    def _csi(self, params, command):
+        args = [int(p) if p.isdigit() else 0
+                for p in params.lstrip('?').split(';')]
+        n = args[0] or 1
+        if command == 'A':
+            self.cy = max(0, self.cy - n)
+        elif command == 'B':
+            self.cy = min(self.height - 1, self.cy + n)
+        elif command == 'C':
+            self.cx = min(self.width - 1, self.cx + n)
+        elif command == 'D':
+            self.cx = max(0, self.cx - n)
+        elif command in 'Hf':
+            row = args[0] or 1
+            col = args[1] if len(args) > 1 and args[1] else 1
+            self.cy = min(self.height - 1, row - 1)
+            self.cx = min(self.width - 1, col - 1)
+        elif command == 'J':
+            self._erase_screen(args[0])
+        elif command == 'K':
+            self._erase_line(self.cy, args[0])
+
+    def _erase_line(self, row, mode):
+        line = self._lines[row]
+        start, end = {0: (self.cx, self.width),
+                      1: (0, self.cx + 1)}.get(mode, (0, self.width))
+        line[start:end] = [' '] * (end - start)
+
+    def _erase_screen(self, mode):
+        if mode == 0:
+            rows = xrange(self.cy + 1, self.height)
+            self._erase_line(self.cy, 0)
+        elif mode == 1:
+            rows = xrange(0, self.cy)
+            self._erase_line(self.cy, 1)
+        else:
+            rows = xrange(self.height)
+        for row in rows:
+            self._lines[row] = [' '] * self.width
+
+    def text(self):
+        return '\n'.join(''.join(line).rstrip() for line in self._lines)
+
+    def dump_html(self):
+        """Screen as ajaxterm "pre" document, cursor highlighted"""
+        cx = min(self.cx, self.width - 1)
+        rows = []
+        for y, line in enumerate(self._lines):
+            if y == self.cy:
+                rows.append('%s<span class="f7 b1">%s</span>%s' % (
+                    cgi.escape(''.join(line[:cx])),
+                    cgi.escape(line[cx]),
+                    cgi.escape(''.join(line[cx + 1:]))))
+            else:
+                rows.append(cgi.escape(''.join(line)))
+        return ('<?xml version="1.0" encoding="ISO-8859-1"?>'
+                '<pre class="term"><span class="f7 b0">%s</span></pre>' %
+                '\n'.join(rows))
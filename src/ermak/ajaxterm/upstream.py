@@ -0,0 +1,138 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+"""Keep-alive HTTP connections from console proxy to compute hosts."""
+
+import socket
+import time
+from collections import defaultdict
+
+from eventlet.green import httplib
+from eventlet.green import select
+
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger("nova.ajaxterm.upstream")
+
+CHUNK_SIZE = 16 * 1024
+# headers describing proxy-upstream connection, not the response
+HOP_BY_HOP = frozenset(['connection', 'keep-alive', 'proxy-authenticate',
+                        'proxy-authorization', 'te', 'trailers',
+                        'transfer-encoding', 'upgrade'])
+# requests which may be sent twice; ajaxterm POSTs carry keystrokes
+IDEMPOTENT = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+
+def _closed_by_peer(conn):
+    """Idle connection has nothing to read unless upstream closed it"""
+    if conn.sock is None:
+        return True
+    readable, _, _ = select.select([conn.sock], [], [], 0)
+    return bool(readable)
+
+
+class UpstreamStats(object):
+    """Request count, errors and time to response headers of upstream"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.reused = 0
+
+    def record(self, elapsed, reused):
+        self.requests += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        if reused:
+            self.reused += 1
+
+    def as_dict(self):
+        avg = self.total_time / self.requests if self.requests else 0.0
+        return {'requests': self.requests,
+                'errors': self.errors,
+                'reused': self.reused,
+                'avg_ms': avg * 1000,
+                'max_ms': self.max_time * 1000}
+
+
+class UpstreamPool(object):
+    """
+    Idle HTTP/1.1 connections kept per (host, port) of compute hosts.
+
+    request() returns status, headers and iterator over body chunks; the
+    connection goes back to the pool once the body is read through.
+    """
+
+    def __init__(self, max_idle=4, timeout=30):
+        self._max_idle = max_idle
+        self._timeout = timeout
+        self._idle = defaultdict(list)
+        self.stats = defaultdict(UpstreamStats)
+
+    def _get(self, upstream):
+        idle = self._idle[upstream]
+        while idle:
+            conn = idle.pop()
+            if not _closed_by_peer(conn):
+                return conn, True
+            conn.close()
+        host, port = upstream
+        return httplib.HTTPConnection(host, port, timeout=self._timeout), \
+            False
+
+    def _put(self, upstream, conn):
+        idle = self._idle[upstream]
+        if len(idle) < self._max_idle:
+            idle.append(conn)
+        else:
+            conn.close()
+
+    def request(self, host, port, method, path, body=None, headers={}):
+        upstream = (host, int(port))
+        started = time.time()
+        conn, reused = self._get(upstream)
+        try:
+            try:
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+            except (socket.error, httplib.HTTPException):
+                if not reused or method not in IDEMPOTENT:
+                    raise
+                # pooled connection was closed by upstream, retry on new
+                conn.close()
+                reused = False
+                conn = httplib.HTTPConnection(
+                    host, int(port), timeout=self._timeout)
+                conn.request(method, path, body, headers)
+                response = conn.getresponse()
+        except Exception:
+            conn.close()
+            self.stats[upstream].errors += 1
+            raise
+        self.stats[upstream].record(time.time() - started, reused)
+        status = "%d %s" % (response.status, response.reason)
+        response_headers = [(name, value)
+                            for name, value in response.getheaders()
+                            if name.lower() not in HOP_BY_HOP]
+        return status, response_headers, \
+            self._body(upstream, conn, response)
+
+    def _body(self, upstream, conn, response):
+        complete = False
+        try:
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+            complete = True
+        finally:
+            if complete and not response.will_close:
+                self._put(upstream, conn)
+            else:
+                conn.close()
+
+    def stats_dict(self):
+        return dict(("%s:%s" % upstream, stats.as_dict())
+                    for upstream, stats in self.stats.iteritems())
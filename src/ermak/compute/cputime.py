@@ -0,0 +1,107 @@
+import time
+
+import psutil
+
+from nova.openstack.common import log as logging
+
+from ermak.util.dynamips import DynamipsError
+
+LOG = logging.getLogger("nova.virt.dynamips.cputime")
+
+# error code of hypervisor reply to command it does not know
+UNKNOWN_COMMAND = '202'
+
+
+def parse_cpu_usage(reply):
+    """Parse reply of "vm cpu_usage", CPU seconds used by the router"""
+    return int(reply[-1][4:].strip())
+
+
+def _process_cpu_time(pid):
+    try:
+        process = psutil.Process(pid)
+        times = process.cpu_times() if hasattr(process, 'cpu_times') \
+            else process.get_cpu_times()
+        return times.user + times.system
+    except psutil.NoSuchProcess:
+        return None
+
+
+class NoCounters(Exception):
+    pass
+
+
+class RouterCpuTimes(object):
+    """
+    CPU seconds used by each router, sampled for all routers at once.
+
+    Routers of a hypervisor are asked with one pipelined batch of
+    "vm cpu_usage" commands. Hypervisors which do not support it are
+    accounted by their process CPU time, split evenly between routers
+    placed on them; that is exact with one router per process. Routers
+    which could not be sampled keep their previous figures.
+    """
+
+    def __init__(self):
+        self._times = {}
+        self._percent = {}
+        self._sampled_at = None
+        self._no_counters = set()
+
+    def sample(self, shards):
+        now = time.time()
+        times = {}
+        placed = set()
+        for shard in shards:
+            if not shard.routers:
+                continue
+            names = sorted(shard.routers)
+            placed.update(names)
+            if shard.index not in self._no_counters:
+                try:
+                    times.update(self._sample_counters(shard, names))
+                    continue
+                except NoCounters:
+                    LOG.info("Hypervisor %s has no per-router CPU counters, "
+                             "using process CPU time" % shard)
+                    self._no_counters.add(shard.index)
+                except DynamipsError as e:
+                    LOG.warn("Can not sample CPU time on %s: %s" % (shard, e))
+                    continue
+            if shard.pid is not None:
+                total = _process_cpu_time(shard.pid)
+                if total is not None:
+                    for name in names:
+                        times[name] = total / len(names)
+        if self._sampled_at is not None:
+            elapsed = now - self._sampled_at
+            self._percent = dict(
+                (name, max(0.0, (t - self._times.get(name, t))) * 100.0 /
+                 elapsed if elapsed > 0 else 0.0)
+                for name, t in times.iteritems())
+        for name, t in self._times.iteritems():
+            if name in placed:
+                times.setdefault(name, t)
+        self._times = times
+        self._sampled_at = now
+
+    def _sample_counters(self, shard, names):
+        replies = shard.client.call_many(
+            ['vm cpu_usage %s 0' % name for name in names],
+            raise_errors=False)
+        times = {}
+        for name, reply in zip(names, replies):
+            if isinstance(reply, DynamipsError):
+                if str(reply).startswith(UNKNOWN_COMMAND):
+                    raise NoCounters()
+                # router may be gone since names were taken
+                continue
+            times[name] = parse_cpu_usage(reply)
+        return times
+
+    def seconds(self, name):
+        return self._times.get(name, 0)
+
+    def percent(self, name):
+        """CPU used between last two samples, percents of one core"""
+        return self._percent.get(name, 0.0)
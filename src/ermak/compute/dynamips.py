@@ -2,24 +2,42 @@ import random
 import subprocess
 import re
 import os
+import time
 
+import eventlet
 import psutil
 
+from nova import context as nova_context
 from nova import flags, exception, db
+from nova.image import glance
 from nova.openstack.common import log as logging
 from nova.openstack.common import cfg
-from nova.virt import images
 from nova.virt.driver import ComputeDriver
 from nova.virt.libvirt.driver import LibvirtDriver
 from nova.compute import instance_types
 from nova.compute import power_state
 from nova import utils
-from nova.utils import ensure_tree, execute
+from nova.utils import ensure_tree
 from dynagen import dynamips_lib
 from dynagen.dynamips_lib import NIO_udp
 
-from ermak.compute.vif import add_alias, delete_alias, list_addresses
-from ermak.util.dynamips import DynamipsClient
+from ermak.ajaxterm.gateway import ConsoleGateway
+from ermak.compute import idlepc
+from ermak.compute.cputime import RouterCpuTimes
+from ermak.compute.ghost import GhostImages
+from ermak.compute.imagecache import ImageCache
+from ermak.compute.manifest import Manifests
+from ermak.compute.niostats import NioStats
+from ermak.compute.ports import PortPool, is_port_free
+from ermak.compute.registry import RouterRegistry
+from ermak.compute.sampler import StatsSampler
+from ermak.compute.shards import HypervisorShards
+from ermak.compute.warmpool import WarmPool, WarmSpec, has_adapters
+from ermak.compute.watchdog import HypervisorWatchdog
+from ermak.compute.vif import AddressBatch
+from ermak.util.console import ConsoleTap
+from ermak.util.dynamips import DynamipsError
+from ermak.util.metrics import METRICS
 
 LOG = logging.getLogger("nova.virt.dynamips")
 dynamips_lib.debug = LOG.debug
@@ -33,12 +51,76 @@ dynamips_opts = [
                help='Connection host for dynamips'),
     cfg.StrOpt('dynamips_port',
                default=7200,
-               help='Connection port for dynamips')]
+               help='Connection port for dynamips'),
+    cfg.IntOpt('dynamips_timeout',
+               default=60,
+               help='Seconds to wait for dynamips reply to a command'),
+    cfg.IntOpt('dynamips_connections',
+               default=4,
+               help='Maximum number of connections to dynamips hypervisor'),
+    cfg.BoolOpt('dynamips_idlepc_auto',
+                default=True,
+                help='Discover idle-pc values for new images automatically'),
+    cfg.IntOpt('dynamips_idlepc_delay',
+               default=60,
+               help='Seconds to let IOS boot before idle-pc discovery'),
+    cfg.BoolOpt('dynamips_ghost_ram',
+                default=False,
+                help='Share IOS memory between routers of the same image'),
+    cfg.IntOpt('dynamips_image_cache_max_gb',
+               default=0,
+               help='Size of cached images to keep, 0 for unlimited'),
+    cfg.IntOpt('dynamips_image_cache_max_age',
+               default=0,
+               help='Seconds to keep unused cached images, 0 for forever'),
+    cfg.BoolOpt('dynamips_unpack_images',
+                default=True,
+                help='Boot routers from uncompressed copies of IOS images'),
+    cfg.ListOpt('dynamips_warm_pool',
+                default=[],
+                help='Routers to keep booted for fast spawn, as list of '
+                     '"flavor:image_ref:count" entries, optionally followed '
+                     'by adapters to install, like '
+                     '"c1.3640:image_ref:2:1=NM-1FE-TX,2=NM-4T"; flavors '
+                     'must be c1.<chassis> ones'),
+    cfg.IntOpt('dynamips_warm_pool_ram_mb',
+               default=2048,
+               help='Maximum RAM of routers kept in warm pool'),
+    cfg.IntOpt('dynamips_stats_interval',
+               default=10,
+               help='Seconds between refreshes of host disk, memory and '
+                    'CPU figures'),
+    cfg.IntOpt('dynamips_console_log_size',
+               default=64 * 1024,
+               help='Bytes of console output kept for each router'),
+    cfg.IntOpt('dynamips_restore_concurrency',
+               default=0,
+               help='Routers restored in parallel after host restart, '
+                    '0 for number of hypervisor connections'),
+    cfg.StrOpt('dynamips_metrics_file',
+               default='$instances_path/dynamips-metrics.json',
+               help='Where latency histograms are written on SIGUSR2'),
+    cfg.IntOpt('dynamips_keepalive_interval',
+               default=10,
+               help='Seconds between keepalive checks of hypervisors, '
+                    '0 to disable reconnecting lost ones'),
+    cfg.IntOpt('dynamips_keepalive_timeout',
+               default=10,
+               help='Seconds hypervisor may take to answer keepalive '
+                    'before it is taken for dead')]
 FLAGS = flags.FLAGS
 flags.DECLARE('vncserver_proxyclient_address', 'nova.vnc')
 FLAGS.register_opts(dynamips_opts)
 
 
+WARM_PREFIX = 'warm_'
+# "vm get_status" codes
+VM_STATES = {'2': 'running', '3': 'suspended'}
+# seconds between attempts to adopt routers init_host failed to
+ADOPT_MIN_RETRY = 30
+ADOPT_MAX_RETRY = 600
+
+
 def _get_image_meta(context, image_ref):
     image_service, image_id = glance.get_remote_image_service(context,
         image_ref)
@@ -49,46 +131,6 @@ def get_connection(read_only=False):
     return DynamipsDriver(read_only)
 
 
-def is_port_free(port):
-    # netcat will exit with 0 only if the port is in use,
-    # so a nonzero return value implies it is unused
-    cmd = 'netcat', 'localhost', port, '-z'
-    try:
-        stdout, stderr = execute(*cmd)
-        return False
-    except exception.ProcessExecutionError:
-        return True
-
-
-class PortPool(object):
-
-    def __init__(self, start_port, end_port):
-        self._ports = {}
-        self._leases = {}
-        self._start_port = start_port
-        self._end_port = end_port
-
-    @utils.synchronized('tcp_port_allocate')
-    def acquire(self, lease):
-        port = self._leases.get(lease)
-        if port and not is_port_free(port):
-            return port
-        else:
-            self.release(lease)
-        for port in xrange(self._start_port, self._end_port):
-            if port not in self._ports and is_port_free(port):
-                self._ports[port] = lease
-                self._leases[lease] = port
-                return port
-        raise Exception("Can not find free port to bind")
-
-    def release(self, lease):
-        port = self._leases.get(lease)
-        if port:
-            del self._leases[lease]
-            del self._ports[port]
-
-
 class RouterWrapper(object):
     """
     Mixin for Router class with openstack conversions
@@ -120,6 +162,39 @@ class RouterWrapper(object):
     def os_prototype(self, instance):
         self.__os_prototype = instance
 
+    os_state_listener = None
+    os_shard = None
+    os_image_key = None
+    os_ghost_key = None
+    os_nios = ()
+    os_console_key = None
+    os_console_tap = None
+
+    def _notify_state(self):
+        if self.os_state_listener:
+            self.os_state_listener(self)
+
+    def start(self):
+        super(RouterWrapper, self).start()
+        self._notify_state()
+
+    def stop(self):
+        super(RouterWrapper, self).stop()
+        self._notify_state()
+
+    def suspend(self):
+        super(RouterWrapper, self).suspend()
+        self._notify_state()
+
+    def resume(self):
+        super(RouterWrapper, self).resume()
+        self._notify_state()
+
+    def rename(self, name):
+        self.os_shard.client.call('vm rename %s %s' % (self.name, name))
+        # dynagen keeps the name in private attribute of Router
+        self._Router__name = name
+
     def start_ajaxterm(self, port):
         if is_port_free(port):
             args = ["ajaxterm",
@@ -144,15 +219,251 @@ class DynamipsDriver(ComputeDriver):
 
     def __init__(self, read_only=False):
         super(DynamipsDriver, self).__init__()
-        self._routers = {}
-        self.dynamips = DynamipsClient(
-            FLAGS.dynamips_host, FLAGS.dynamips_port)
+        self._routers = RouterRegistry()
+        self._shards = HypervisorShards(
+            FLAGS.dynamips_host, FLAGS.dynamips_port, FLAGS.dynamips_timeout,
+            FLAGS.dynamips_connections)
+        self._shards.start()
         start_port, end_port = FLAGS.ajaxterm_portrange.split("-")
         start_port, end_port = int(start_port), int(end_port)
-        self._port_pool = PortPool(start_port, end_port)
+        ensure_tree(FLAGS.instances_path)
+        self._port_pool = PortPool(
+            start_port, end_port,
+            os.path.join(FLAGS.instances_path, 'console-ports.json'))
+        self._idlepc = idlepc.IdlePCCache(
+            os.path.join(FLAGS.instances_path, 'idlepc.json'))
+        self._idlepc_pending = set()
+        ghost_dir = os.path.join(FLAGS.instances_path, 'ghosts')
+        ensure_tree(ghost_dir)
+        self._ghosts = GhostImages(ghost_dir)
+        self._images = ImageCache(
+            os.path.join(FLAGS.instances_path, FLAGS.base_dir_name),
+            unpack=FLAGS.dynamips_unpack_images)
+        self._manifests = Manifests(
+            os.path.join(FLAGS.instances_path, 'routers'))
+        self._warm_pool = None
+        self._console_gateway = None
+        if FLAGS.ajaxterm_gateway:
+            self._console_gateway = ConsoleGateway(
+                FLAGS.ajaxterm_static_path, FLAGS.ajaxterm_session_timeout)
+        self._cpu_times = RouterCpuTimes()
+        self._nio_stats = NioStats()
+        self._host_stats = StatsSampler(
+            self._sample_host, FLAGS.dynamips_stats_interval)
+        self._watchdog = HypervisorWatchdog(
+            self._shards.shards, FLAGS.dynamips_keepalive_interval,
+            FLAGS.dynamips_keepalive_timeout, self._shards.revive,
+            self._resync)
+        self._unadopted = {}
+        self._initialized = False
 
     def init_host(self, host):
-        pass
+        if self._initialized:
+            return
+        self._initialized = True
+        METRICS.dump_on_signal(FLAGS.dynamips_metrics_file)
+        self._reconcile(host)
+        self._host_stats.start()
+        if FLAGS.dynamips_keepalive_interval > 0:
+            self._watchdog.start()
+        if self._console_gateway is not None:
+            self._console_gateway.start(FLAGS.ajaxterm_gateway_host,
+                                        FLAGS.ajaxterm_gateway_port)
+        if FLAGS.dynamips_warm_pool:
+            ram_for_flavor = lambda name: \
+                instance_types.get_instance_type_by_name(name)["memory_mb"]
+            specs = [WarmSpec.parse(entry, ram_for_flavor)
+                     for entry in FLAGS.dynamips_warm_pool]
+            self._warm_pool = WarmPool(specs, self._create_warm_router,
+                                       FLAGS.dynamips_warm_pool_ram_mb)
+            self._warm_pool.start()
+
+    def _reconcile(self, host):
+        """
+        Adopt routers left on hypervisors by previous compute process,
+        without restarting them
+        """
+        context = nova_context.get_admin_context()
+        instances = dict((str(i["id"]), i)
+                         for i in db.instance_get_all_by_host(context, host))
+        seen = set()
+        listed = set()
+        for shard in self._shards.shards:
+            try:
+                names = shard.client.vm_list()
+                nios = shard.client.nio_list()
+                replies = shard.client.call_many(
+                    ['vm get_status %s' % name for name in names],
+                    raise_errors=False)
+            except DynamipsError:
+                LOG.exception("Can not list routers of %s" % shard)
+                continue
+            listed.add(shard.index)
+            for name, reply in zip(names, replies):
+                if isinstance(reply, DynamipsError):
+                    continue
+                seen.add(name)
+                state = VM_STATES.get(reply[-1][4:].strip(), 'stopped')
+                instance = instances.get(name)
+                manifest = self._manifests.load(name)
+                if instance is not None and manifest is not None and \
+                        manifest['shard'] == shard.index:
+                    try:
+                        self._adopt_router(
+                            context, instance, manifest, shard, state)
+                    except Exception:
+                        # the router still runs, e.g. glance is down
+                        LOG.exception("Can not adopt router %s, will retry"
+                                      % name)
+                        self._unadopted[name] = (instance, manifest, shard)
+                    continue
+                elif instance is None and not name.startswith(WARM_PREFIX):
+                    LOG.warn("Unknown router %s on %s is left as is" %
+                             (name, shard))
+                    continue
+                # let it be created anew; its NIOs would keep their
+                # names and UDP ports otherwise
+                LOG.info("Deleting stale router %s on %s" % (name, shard))
+                prefix = 'nio_udp_%s_' % name
+                try:
+                    shard.client.call_many(
+                        ['vm stop %s' % name, 'vm delete %s' % name] +
+                        ['nio delete %s' % nio for nio in nios
+                         if nio.startswith(prefix)],
+                        raise_errors=False)
+                except DynamipsError:
+                    LOG.exception("Can not delete stale router %s" % name)
+                    continue
+                self._manifests.delete(name)
+        # routers of hypervisors which could not be listed may still run
+        for name in self._manifests.names():
+            manifest = self._manifests.load(name)
+            if name not in seen and manifest['shard'] in listed:
+                self._manifests.delete(name)
+        LOG.info("Adopted %d running routers" % len(self._routers))
+        if self._unadopted:
+            eventlet.spawn_n(self._retry_adoption, context)
+
+    def _retry_adoption(self, context):
+        """Adopt routers _reconcile failed to, with growing delay"""
+        delay = ADOPT_MIN_RETRY
+        while self._unadopted:
+            eventlet.sleep(delay)
+            delay = min(delay * 2, ADOPT_MAX_RETRY)
+            for name, (instance, manifest, shard) in \
+                    self._unadopted.items():
+                try:
+                    if name not in shard.client.vm_list():
+                        LOG.warn("Router %s is gone, not adopting it" % name)
+                        del self._unadopted[name]
+                        continue
+                    reply = shard.client.call('vm get_status %s' % name)
+                except DynamipsError as e:
+                    LOG.warn("Can not query router %s: %s" % (name, e))
+                    continue
+                state = VM_STATES.get(reply[-1][4:].strip(), 'stopped')
+                try:
+                    self._adopt_router(
+                        context, instance, manifest, shard, state)
+                except Exception:
+                    LOG.exception("Can not adopt router %s" % name)
+                    continue
+                del self._unadopted[name]
+                LOG.info("Adopted router %s" % name)
+
+    def _adopt_router(self, context, instance, manifest, shard, state):
+        """Rebuild objects of existing router, sending no commands"""
+        image_meta = self._image_meta(context, instance["image_ref"])
+        old_nosend = dynamips_lib.NOSEND
+        dynamips_lib.NOSEND = True
+        try:
+            r = self._build_router(
+                context, instance, image_meta, manifest['vifs'], shard)
+            r.console = manifest['console']
+            # dynagen keeps the state in private attribute of Router
+            r._Router__state = state
+        finally:
+            dynamips_lib.NOSEND = old_nosend
+        # routers created later must not take adopted console ports
+        shard.client.baseconsole = max(shard.client.baseconsole,
+                                       manifest['console'] + 1)
+        self._routers.add(instance, r)
+        self._tap_console(r)
+        LOG.debug("Adopted %s router %s" % (state, r.name))
+
+    def _resync(self, shard):
+        """
+        Bring routers of reconnected hypervisor in line with it: update
+        states of those it still has, and create anew ones it lost when
+        it was restarted, starting them if they were running
+        """
+        names = set(shard.client.vm_list())
+        routers = [r for r in self._routers.values() if r.os_shard is shard]
+        present = [r for r in routers if str(r.name) in names]
+        replies = shard.client.call_many(
+            ['vm get_status %s' % r.name for r in present],
+            raise_errors=False)
+        for r, reply in zip(present, replies):
+            if isinstance(reply, DynamipsError):
+                continue
+            state = VM_STATES.get(reply[-1][4:].strip(), 'stopped')
+            if state != r.state:
+                LOG.info("Router %s is %s, not %s" % (r.name, state, r.state))
+                r._Router__state = state
+                r._notify_state()
+        lost = [r for r in routers if str(r.name) not in names]
+        if lost:
+            LOG.warn("Hypervisor %s lost %d routers, recreating them" %
+                     (shard, len(lost)))
+        context = nova_context.get_admin_context()
+        for r in lost:
+            try:
+                self._rebuild_router(context, r)
+            except Exception:
+                LOG.exception("Can not recreate router %s" % r.name)
+        if self._warm_pool is not None:
+            self._warm_pool.forget(
+                lambda r: r.os_shard is shard and str(r.name) not in names)
+
+    def _rebuild_router(self, context, old):
+        """Create router again from its manifest, keeping console"""
+        instance = old.os_prototype
+        manifest = self._manifests.load(str(old.name))
+        if manifest is None:
+            raise exception.NotFound("No manifest of router %s" % old.name)
+        # old router stays registered until the new one replaces it, so
+        # it is rebuilt again on next resync if this fails
+        try:
+            image_meta = self._image_meta(context, instance["image_ref"])
+            r = self._build_router(context, instance, image_meta,
+                                   manifest['vifs'], old.os_shard)
+        except Exception:
+            old._Router__state = 'stopped'
+            old._notify_state()
+            if old.os_console_tap is not None:
+                old.os_console_tap.stop()
+            raise
+        if old.os_ghost_key:
+            self._ghosts.release(old.os_ghost_key)
+        self._images.release(instance["image_ref"])
+        r.console = manifest['console']
+        # console tap and gateway sessions reconnect to the same port
+        r.os_console_tap = old.os_console_tap
+        r.os_console_key = old.os_console_key
+        if r.os_console_tap is not None:
+            r.os_console_tap.start()
+        self._routers.add(instance, r)
+        if old.state != 'stopped':
+            r.start()
+
+    def _save_manifest(self, router, network_info):
+        self._manifests.save(str(router.name), {
+            'shard': router.os_shard.index,
+            'console': router.console,
+            'vifs': [{'meta': {
+                'quantum_udp_attrs': vif['meta']['quantum_udp_attrs'],
+                'quantum_port_attrs': vif['meta']['quantum_port_attrs']}}
+                for vif in network_info]})
 
     def legacy_nwinfo(self):
         return False
@@ -166,22 +477,21 @@ class DynamipsDriver(ComputeDriver):
             'max_mem': int(mem_mb) * 1024,
             'mem': n.ram * 1024,
             'num_cpu': 1,
-            'cpu_time': 0  # cpuinfo?
+            'cpu_time': self._cpu_times.seconds(n.name) * 1000000000
         }
 
     def _router_by_name(self, name):
-        try:
-            return filter(lambda r: r.os_name == name,
-                          self._routers.itervalues())[0]
-        except IndexError:
+        router = self._routers.by_name(name)
+        if router is None:
             raise exception.InstanceNotFound(instance_id=name)
+        return router
 
     def list_instances(self):
         """Lists instances
 
         :return list of names
         """
-        return map(lambda x: x.os_name, self._routers.itervalues())
+        return self._routers.names()
 
     def _class_for_platform(self, platform):
         try:
@@ -206,28 +516,31 @@ class DynamipsDriver(ComputeDriver):
             pass
         return CurrentRouter
 
-    def _instance_to_router(self, context, instance, image_meta):
+    def _instance_to_router(self, context, instance, image_meta, shard):
         inst_type = \
             instance_types.get_instance_type(instance["instance_type_id"])
         chassis = self._chassis_for_flavor(inst_type['name'])
         C = self._class_for_instance(image_meta)
-        r = C(self.dynamips, name=instance["id"], chassis=chassis)
+        r = C(shard.client, name=instance["id"], chassis=chassis)
+        r.os_shard = shard
         r.os_name = instance["name"]
         r.ram = inst_type["memory_mb"]
         r.os_prototype = instance
         return r
 
-    def _setup_image(self, context, instance):
-        base_dir = os.path.join(FLAGS.instances_path, FLAGS.base_dir_name)
-        if not os.path.exists(base_dir):
-            ensure_tree(base_dir)
-        path = os.path.abspath(os.path.join(base_dir, instance["image_ref"]))
-        if not os.path.exists(path):
-            images.fetch_to_raw(
-                context, instance["image_ref"], path,
-                instance["user_id"], instance["project_id"])
+    def _setup_image(self, context, instance, image_meta):
+        path = self._images.acquire(
+            context, instance, image_meta.get('checksum'))
+        if self._images.meta(instance["image_ref"]) is None:
+            self._images.save_meta(instance["image_ref"], image_meta)
         return path
 
+    def _image_meta(self, context, image_ref):
+        """Image metadata from image cache, from glance if not cached"""
+        image_meta = self._images.meta(image_ref)
+        if image_meta is None:
+            image_meta = _get_image_meta(context, image_ref)
+        return image_meta
 
     def _mklabel(self, ip):
         return "%02x%02x%02x%02x" % tuple(map(int, ip.split('.')))
@@ -235,83 +548,343 @@ class DynamipsDriver(ComputeDriver):
     def _withmask(self, addr, prefix):
         return str(addr) + '/' + str(prefix)
 
-    @utils.synchronized('udp_channel_setup')
     def _setup_network(self, context, router, instance, network_info):
+        # hypervisor must not be waited for under udp_channel_setup lock,
+        # since the watchdog needs that lock to recreate lost routers
+        router.os_shard.client.wait_online()
+        for vif in network_info:
+            port_attrs = vif['meta']['quantum_port_attrs']
+            if not router.slot[port_attrs['slot-id']]:
+                model = port_attrs['slot-model']
+                if not model:
+                    LOG.error("Errant vif: %s" % vif)
+                    raise Exception("Expected slot model to be defined")
+                self._install_adapter(router, port_attrs['slot-id'], model)
+        # router creation and config need no lock, only UDP channels do
+        router.os_shard.client.flush()
+        self._setup_channels(context, router, instance, network_info)
+
+    @utils.synchronized('udp_channel_setup')
+    def _setup_channels(self, context, router, instance, network_info):
+        aliases = AddressBatch(FLAGS.data_iface)
+        restore_aliases = AddressBatch(FLAGS.data_iface)
+        channels = []
         for vif in network_info:
-            iface = FLAGS.data_iface
             udp_attrs = vif['meta']['quantum_udp_attrs']
             port_attrs = vif['meta']['quantum_port_attrs']
-            on_same_machine = udp_attrs['dst-address'] in list_addresses(iface)
-            LOG.debug("UDP attrs are %s, addresses are %s, on_same_machine is %s" % (udp_attrs, list_addresses(iface), on_same_machine))
+            on_same_machine = aliases.has_address(udp_attrs['dst-address'])
+            LOG.debug("UDP attrs are %s, on_same_machine is %s" %
+                      (udp_attrs, on_same_machine))
 
-            add_alias(
-                iface,
+            aliases.add(
                 self._withmask(
                     udp_attrs['src-address'], udp_attrs['prefix-len']),
                 label=self._mklabel(udp_attrs['src-address']))
             if on_same_machine:
-                delete_alias(
-                    iface,
-                    self._withmask(
-                        udp_attrs['dst-address'], udp_attrs['prefix-len']),
-                    label=self._mklabel(udp_attrs['dst-address']))
-            adapter = router.slot[port_attrs['slot-id']]
-            if not adapter:
-                model = port_attrs['slot-model']
-                if model:
-                    class_ = getattr(dynamips_lib, model.replace('-', '_'))
-                    adapter = class_(router, port_attrs['slot-id'])
-                    router.slot[port_attrs['slot-id']] = adapter
-                else:
-                    LOG.error("Errant vif: %s" % vif)
-                    raise Exception("Expected slot model to be defined")
-            LOG.debug("Creating nio to %s, addresses are %s" % (udp_attrs['dst-address'], list_addresses(iface)))
-            nio = NIO_udp(
-                self.dynamips,
-                udp_attrs['src-port'],
-                udp_attrs['dst-address'],
-                udp_attrs['dst-port'],
-                adapter=adapter,
-                port=port_attrs['port-id'])
-            adapter.nio(port_attrs['port-id'], nio)
-            if on_same_machine:
-                add_alias(
-                    iface,
-                    self._withmask(
-                        udp_attrs['dst-address'], udp_attrs['prefix-len']),
-                    label=self._mklabel(udp_attrs['dst-address']))
+                dst = self._withmask(
+                    udp_attrs['dst-address'], udp_attrs['prefix-len'])
+                aliases.delete(
+                    dst, label=self._mklabel(udp_attrs['dst-address']))
+                restore_aliases.add(
+                    dst, label=self._mklabel(udp_attrs['dst-address']))
+            channels.append((vif, udp_attrs, port_attrs))
+        # adopted router's aliases are there since it was spawned
+        adopting = dynamips_lib.NOSEND
+        if not adopting:
+            with METRICS.timer('spawn.aliases'):
+                aliases.apply()
+
+        nios = []
+        try:
+            for vif, udp_attrs, port_attrs in channels:
+                adapter = router.slot[port_attrs['slot-id']]
+                LOG.debug("Creating nio to %s" % udp_attrs['dst-address'])
+                nio = NIO_udp(
+                    router.os_shard.client,
+                    udp_attrs['src-port'],
+                    udp_attrs['dst-address'],
+                    udp_attrs['dst-port'],
+                    # stable name lets NIO be found after compute restart
+                    name='nio_udp_%s_%s_%s' % (router.name,
+                                               port_attrs['slot-id'],
+                                               port_attrs['port-id']),
+                    adapter=adapter,
+                    port=port_attrs['port-id'])
+                adapter.nio(port_attrs['port-id'], nio)
+                nios.append(nio.name)
+            router.os_shard.client.wait_online(0)
+            router.os_shard.client.flush()
+            router.os_nios = tuple(nios)
+        finally:
+            if not adopting:
+                restore_aliases.apply()
+
+    def _install_adapter(self, router, slot_id, model):
+        class_ = getattr(dynamips_lib, model.replace('-', '_'))
+        adapter = class_(router, slot_id)
+        router.slot[slot_id] = adapter
+        return adapter
 
-    @utils.synchronized('udp_channel_setup')
     def _tear_down_network(self, router, instance, network_info):
+        """Unbind and delete NIOs of router, then remove its aliases"""
+        commands = []
+        for vif in network_info:
+            port_attrs = vif['meta']['quantum_port_attrs']
+            commands.append('vm slot_remove_nio_binding %s %s %s' % (
+                router.name, port_attrs['slot-id'], port_attrs['port-id']))
+        commands.extend('nio delete %s' % name for name in router.os_nios)
+        router.os_nios = ()
+        try:
+            replies = router.os_shard.client.call_many(
+                commands, raise_errors=False)
+        except DynamipsError:
+            LOG.exception("Can not delete NIOs of router %s" % router.name)
+        else:
+            for command, reply in zip(commands, replies):
+                if isinstance(reply, DynamipsError):
+                    LOG.error("%s failed: %s" % (command, reply))
+        self._delete_aliases(network_info)
+
+    @utils.synchronized('udp_channel_setup')
+    def _delete_aliases(self, network_info):
+        aliases = AddressBatch(FLAGS.data_iface)
         for vif in network_info:
+            udp_attrs = vif['meta']['quantum_udp_attrs']
+            aliases.delete(
+                self._withmask(
+                    udp_attrs['src-address'], udp_attrs['prefix-len']),
+                label=self._mklabel(udp_attrs['src-address']))
+        aliases.apply()
+
+    def _acquire_ghost(self, shard, instance, image_meta, image):
+        inst_type = \
+            instance_types.get_instance_type(instance["instance_type_id"])
+        platform = image_meta['properties']['dynamips_platform']
+        key = (image, platform, inst_type["memory_mb"])
+
+        def create(path):
+            """Boot ghost instance, which makes dynamips write IOS memory"""
+            LOG.debug("Creating ghost file %s" % path)
+            ghost = self._class_for_platform(platform)(
+                shard.client,
+                name=re.sub(r'\W', '_', os.path.basename(path)),
+                chassis=self._chassis_for_flavor(inst_type['name']))
             try:
-                iface = FLAGS.data_iface
-                udp_attrs = vif['meta']['quantum_udp_attrs']
-                port_attrs = vif['meta']['quantum_port_attrs']
-                adapter = router.slot[port_attrs['slot-id']]
-                (dynint, dynport) = nio.interfaces_mips2dyn[port_attrs['port-id']]
-                adapter.disconnect(dynint, dynport)
-                adapter.delete_nio(dynint, dynport)
-                delete_alias(
-                    iface,
-                    self._withmask(
-                        udp_attrs['src-address'], udp_attrs['prefix-len']),
-                    label=self._mklabel(udp_attrs['src-address']))
-            except Exception as e:
-                LOG.error("Can not deallocate vif %s" % vif, e)
+                ghost.image = image
+                ghost.ram = inst_type["memory_mb"]
+                ghost.mmap = True
+                ghost.ghost_file = path
+                ghost.ghost_status = 1
+                ghost.start()
+                ghost.stop()
+            finally:
+                try:
+                    ghost.delete()
+                except DynamipsError:
+                    LOG.exception("Can not delete ghost instance %s" %
+                                  ghost.name)
+
+        return key, self._ghosts.acquire(key, create)
+
+    def _build_router(self, context, instance, image_meta, network_info,
+                      shard=None, adapters=None):
+        """
+        Create router on least loaded hypervisor, without starting it
+
+        :param adapters: dict of slot number to model of adapters to
+                         install besides those network_info needs
+        """
+        with METRICS.timer('spawn.image'):
+            image = self._setup_image(context, instance, image_meta)
+        if shard is None:
+            shard = self._shards.place()
+        ghost_key = None
+        r = None
+        try:
+            if FLAGS.dynamips_ghost_ram:
+                try:
+                    with METRICS.timer('spawn.ghost'):
+                        ghost_key, ghost_file = self._acquire_ghost(
+                            shard, instance, image_meta, image)
+                except Exception:
+                    # router works without ghost, only takes more RAM
+                    LOG.exception("Can not create ghost file, spawning %s "
+                                  "without it" % instance["name"])
+            # dynagen objects only queue their commands here; network setup
+            # sends router commands as one batch and NIO ones as another,
+            # each rolled back as a whole if any of its commands fails
+            with METRICS.timer('spawn.create'), shard.client.deferred():
+                r = self._instance_to_router(
+                    context, instance, image_meta, shard)
+                r.image = image
+                if ghost_key:
+                    r.mmap = True
+                    r.ghost_status = 2
+                    r.ghost_file = ghost_file
+                    r.os_ghost_key = ghost_key
+                else:
+                    r.mmap = False
+                r.os_image_key = self._image_key(instance, image_meta)
+                idlepc_value = self._idlepc.get(r.os_image_key)
+                if idlepc_value:
+                    r.idlepc = idlepc_value
+                for slot_id, model in sorted((adapters or {}).items()):
+                    self._install_adapter(r, slot_id, model)
+                with METRICS.timer('spawn.network'):
+                    self._setup_network(context, r, instance, network_info)
+        except Exception:
+            if r is not None and not dynamips_lib.NOSEND:
+                # router is created before its channels; if its own
+                # batch failed, it is rolled back already
+                try:
+                    r.delete()
+                except DynamipsError:
+                    pass
+            if ghost_key:
+                self._ghosts.release(ghost_key)
+            self._images.release(instance["image_ref"])
+            raise
+        shard.routers.add(r.name)
+        return r
 
     def _do_create_instance(self, context, instance, image_meta, network_info):
-        image = self._setup_image(context, instance)
-        r = self._instance_to_router(context, instance, image_meta)
-        self._setup_network(context, r, instance, network_info)
-        r.image = image
-        r.mmap = False
-        self._routers[instance["id"]] = r
+        r = self._build_router(context, instance, image_meta, network_info)
+        self._routers.add(instance, r)
+        self._save_manifest(r, network_info)
+        self._tap_console(r)
+
+    def _tap_console(self, router):
+        router.os_console_tap = ConsoleTap(
+            router.os_shard.host, router.console,
+            FLAGS.dynamips_console_log_size)
+        router.os_console_tap.start()
+
+    def _create_warm_router(self, spec):
+        context = nova_context.get_admin_context()
+        name = WARM_PREFIX + utils.gen_uuid().hex
+        instance = {
+            'id': name,
+            'name': name,
+            'image_ref': spec.image_ref,
+            'instance_type_id':
+                instance_types.get_instance_type_by_name(spec.flavor)['id'],
+            'user_id': context.user_id,
+            'project_id': context.project_id}
+        image_meta = self._image_meta(context, spec.image_ref)
+        r = self._build_router(context, instance, image_meta, [],
+                               adapters=spec.adapters)
+        try:
+            r.start()
+        except Exception:
+            self._discard_router(r)
+            raise
+        LOG.debug("Warm router %s is ready" % name)
+        return r
+
+    def _discard_router(self, r):
+        """Delete router which is not registered for any instance"""
+        try:
+            r.stop()
+        except DynamipsError:
+            pass
+        try:
+            r.delete()
+        except DynamipsError:
+            LOG.exception("Can not delete router %s" % r.name)
+        r.os_shard.routers.discard(r.name)
+        if r.os_ghost_key:
+            self._ghosts.release(r.os_ghost_key)
+        self._images.release(r.os_prototype["image_ref"])
+
+    def _claim_warm_router(self, context, instance, network_info):
+        """Take booted router from warm pool and wire it for instance"""
+        if self._warm_pool is None:
+            return None
+        inst_type = \
+            instance_types.get_instance_type(instance["instance_type_id"])
+        slots = dict((vif['meta']['quantum_port_attrs']['slot-id'],
+                      vif['meta']['quantum_port_attrs']['slot-model'])
+                     for vif in network_info)
+        # adapters can not be installed into running router
+        r = self._warm_pool.claim(
+            inst_type['name'], instance["image_ref"],
+            lambda r: has_adapters(r, slots))
+        LOG.debug("Warm pool stats: %s" % self._warm_pool.stats())
+        if r is None:
+            return None
+        try:
+            r.os_shard.routers.discard(r.name)
+            r.rename(instance["id"])
+            r.os_shard.routers.add(r.name)
+            r.os_name = instance["name"]
+            r.os_prototype = instance
+            with r.os_shard.client.deferred():
+                self._setup_network(context, r, instance, network_info)
+            self._routers.add(instance, r)
+            self._save_manifest(r, network_info)
+            self._tap_console(r)
+        except Exception:
+            LOG.exception("Can not use warm router %s, spawning new one" %
+                          r.name)
+            if self._routers.get(instance["id"]) is r:
+                self._routers.remove(instance["id"])
+            if r.os_console_tap is not None:
+                r.os_console_tap.stop()
+            self._manifests.delete(str(r.name))
+            self._discard_router(r)
+            return None
+        return r
+
+    def get_warm_pool_stats(self):
+        return self._warm_pool.stats() if self._warm_pool else {}
 
     def spawn(self, context, instance, image_meta, injected_files,
               admin_password, network_info=[], block_device_info=None):
-        self._do_create_instance(context, instance, image_meta, network_info)
-        self._router_by_name(instance["name"]).start()
+        with METRICS.timer('spawn.total'):
+            r = self._claim_warm_router(context, instance, network_info)
+            if r is None:
+                self._do_create_instance(
+                    context, instance, image_meta, network_info)
+                r = self._router_by_name(instance["name"])
+                with METRICS.timer('spawn.start'):
+                    r.start()
+        self._schedule_idlepc_discovery(r)
+
+    def _image_key(self, instance, image_meta):
+        return image_meta.get('checksum') or instance["image_ref"]
+
+    def _schedule_idlepc_discovery(self, router):
+        key = router.os_image_key
+        if not FLAGS.dynamips_idlepc_auto or key in self._idlepc or \
+                key in self._idlepc_pending:
+            return
+        self._idlepc_pending.add(key)
+        eventlet.spawn_n(self._discover_idlepc, router, key)
+
+    def _discover_idlepc(self, router, key):
+        """Compute idle-pc on booted router and apply it to its image"""
+        try:
+            eventlet.sleep(FLAGS.dynamips_idlepc_delay)
+            instance_id = router.os_prototype["id"]
+            if self._routers.get(instance_id) is not router or \
+                    router.state != 'running':
+                return
+            reply = router.os_shard.client.call(
+                'vm get_idle_pc_prop %s 0' % router.name)
+            value = idlepc.choose(idlepc.parse_candidates(reply))
+            if value is None:
+                LOG.warning("No idle-pc candidates for image %s" % key)
+                return
+            LOG.info("Using idle-pc %s for image %s" % (value, key))
+            self._idlepc.set(key, value)
+            for r in self._routers.values():
+                if r.os_image_key == key and r.state == 'running':
+                    r.os_shard.client.call(
+                        'vm set_idle_pc_online %s 0 %s' % (r.name, value))
+        except Exception:
+            LOG.exception("Idle-pc discovery failed for image %s" % key)
+        finally:
+            self._idlepc_pending.discard(key)
 
     def destroy(self, instance, network_info, block_device_info=None):
         try:
@@ -320,26 +893,38 @@ class DynamipsDriver(ComputeDriver):
             r = None
 
         if r is not None:
-            r.stop_ajaxterm()
+            self._close_console(r)
+            if self._console_gateway is not None:
+                self._console_gateway.unregister(r.os_console_key)
+            self._port_pool.release(instance["id"])
+            if r.os_console_tap is not None:
+                r.os_console_tap.stop()
             r.stop()  # TODO: error "unable to stop instance" may occur
             self._tear_down_network(r, instance, network_info)
             r.delete()
-            del self._routers[r.name]
-            # TODO: remove IOS image (?)
+            self._routers.remove(instance["id"])
+            self._manifests.delete(str(r.name))
+            r.os_shard.routers.discard(r.name)
+            if r.os_ghost_key:
+                self._ghosts.release(r.os_ghost_key)
+            self._images.release(r.os_prototype["image_ref"])
             # TODO: remove ramdisks (?)
 
     def reboot(self, instance, network_info, reboot_type,
                block_device_info=None):
         r = self._routers[instance["id"]]
-        r.stop_ajaxterm()
+        self._close_console(r)
         r.stop()
         r.start()
 
     # get_console_pool_info
 
     def get_console_output(self, instance):
-        # TODO: dunno
-        raise NotImplementedError()
+        """Last dynamips_console_log_size bytes printed on console"""
+        r = self._routers[instance["id"]]
+        if r.os_console_tap is None:
+            return ''
+        return r.os_console_tap.output()
 
     def get_vnc_console(self, instance):
         raise NotImplementedError("Use get_web_console instead")
@@ -353,11 +938,39 @@ class DynamipsDriver(ComputeDriver):
         """
         LOG.debug("Available instance ids are: %s" % self._routers.keys())
         r = self._routers[instance["id"]]
+        if self._console_gateway is not None:
+            r.os_console_key = self._console_gateway.register(
+                r.os_console_tap, r.os_console_key)
+            return {'host': FLAGS.vncserver_proxyclient_address,
+                    'port': FLAGS.ajaxterm_gateway_port,
+                    'internal_access_path': r.os_console_key}
         port = self._port_pool.acquire(instance["id"])
         host, port = r.start_ajaxterm(port)
         return {'host': host, 'port': port, 'internal_access_path': None}
 
-    # get_diagnostics
+    def get_websocket_console(self, instance):
+        """Get host, port and routing key of console gateway"""
+        if self._console_gateway is None:
+            raise exception.ConsoleTypeInvalid(console_type='websocket')
+        return self.get_web_console(instance)
+
+    def _close_console(self, router):
+        """Drop console sessions, router console is going away"""
+        if self._console_gateway is not None:
+            self._console_gateway.close_session(router.os_console_key)
+        else:
+            router.stop_ajaxterm()
+
+    def get_diagnostics(self, instance):
+        r = self._router_by_name(instance["name"])
+        return {
+            'state': r.state,
+            'cpu_time': self._cpu_times.seconds(r.name),
+            'cpu_percent': self._cpu_times.percent(r.name),
+            'idlepc': r.idlepc,
+            'ram_mb': r.ram,
+            'hypervisor': '%s:%s' % (r.os_shard.host, r.os_shard.port)}
+
     # get_all_bw_usage
 
     def get_host_ip_addr(self):
@@ -399,12 +1012,59 @@ class DynamipsDriver(ComputeDriver):
         except exception.NotFound:
             return power_state.NOSTATE
 
+    def restore_instances(self, context, instances, get_network_info):
+        """
+        Recreate and start routers of instances after host restart, in
+        parallel, so resume_state_on_host_boot finds them running.
+
+        :param get_network_info: callable giving network info of instance
+        """
+        # routers not adopted yet still run, they must not be recreated
+        missing = [i for i in instances
+                   if self._current_state_for_instance(i) ==
+                   power_state.NOSTATE and
+                   str(i["id"]) not in self._unadopted]
+        if not missing:
+            return
+        concurrency = FLAGS.dynamips_restore_concurrency or \
+            len(self._shards.shards) * FLAGS.dynamips_connections
+        LOG.info("Restoring %d routers, %d at a time" %
+                 (len(missing), concurrency))
+        started = time.time()
+        done = failed = 0
+        pool = eventlet.GreenPool(concurrency)
+        for instance, error in pool.imap(
+                lambda i: self._restore_instance(context, i, get_network_info),
+                missing):
+            done += 1
+            if error is not None:
+                failed += 1
+                LOG.error("Can not restore instance %s: %s" %
+                          (instance["name"], error))
+            LOG.info("Restored %d/%d routers, %d failed, %.1f s" %
+                     (done, len(missing), failed, time.time() - started))
+
+    def _restore_instance(self, context, instance, get_network_info):
+        try:
+            image_meta = self._image_meta(context, instance['image_ref'])
+            self._do_create_instance(context, instance, image_meta,
+                                     get_network_info(instance))
+            self._routers[instance["id"]].start()
+            return instance, None
+        except Exception as e:
+            LOG.exception("Restore of instance %s failed" % instance["name"])
+            return instance, e
+
     def resume_state_on_host_boot(self, context, instance, network_info,
                                   block_device_info=None):
         """resume guest state when a host is booted"""
         current_state = self._current_state_for_instance(instance)
-        image_meta = _get_image_meta(context, instance['image_ref'])
+        if str(instance["id"]) in self._unadopted:
+            LOG.warn("Router of %s is not adopted yet, leaving it as is" %
+                     instance["name"])
+            return current_state
         if current_state == power_state.NOSTATE:
+            image_meta = self._image_meta(context, instance['image_ref'])
             self._do_create_instance(context, instance, image_meta, network_info)
         current_state = self._current_state_for_instance(instance)
 
@@ -420,23 +1080,51 @@ class DynamipsDriver(ComputeDriver):
     def power_off(self, instance):
         """Power off the specified instance."""
         r = self._routers[instance["id"]]
-        r.stop_ajaxterm()
+        self._close_console(r)
         r.stop()  # TODO: semantics may differ
 
     def power_on(self, instance):
         """Power on the specified instance"""
         self._routers[instance["id"]].start()  # TODO: semantics may differ
 
+    def _sample_host(self):
+        """Collect host figures which are expensive to get"""
+        try:
+            self._cpu_times.sample(self._shards.shards)
+        except Exception:
+            LOG.exception("Can not sample router CPU time")
+        try:
+            self._sample_nios()
+        except Exception:
+            LOG.exception("Can not sample NIO counters")
+        return {
+            'disk_usage': psutil.disk_usage('/'),
+            'mem_usage': psutil.virtual_memory(),
+            'vcpus': LibvirtDriver.get_vcpu_total()}
+
+    def _sample_nios(self):
+        nios = dict((shard, []) for shard in self._shards.shards)
+        for r in self._routers.values():
+            if r.os_shard is not None:
+                nios[r.os_shard].extend(r.os_nios)
+        self._nio_stats.sample(nios.items())
+
     def _gen_stats(self):
         """Return currently known host stats"""
-        disk_usage = psutil.disk_usage('/')
+        host = self._host_stats.snapshot()
+        disk_usage = host['disk_usage']
         local_gb = disk_usage.total / GB
         local_gb_used = disk_usage.used / GB
         disk_available_least = disk_usage.free / GB
 
-        mem_usage = psutil.virtual_memory()
+        mem_usage = host['mem_usage']
         memory_mb = mem_usage.total / MB
-        memory_mb_used = mem_usage.used / MB
+        # routers touch their RAM lazily, so count what is promised to
+        # them, except IOS memory shared through ghost files
+        committed_mb = self._routers.ram_mb - self._ghosts.saved_mb()
+        if self._warm_pool is not None:
+            committed_mb += self._warm_pool.ram_used()
+        memory_mb_used = max(mem_usage.used / MB, committed_mb)
 
         # list of (arch, hypervisor_type, vm_mode)
         capabilities = [
@@ -444,7 +1132,7 @@ class DynamipsDriver(ComputeDriver):
         ]
 
         return {
-            'vcpus': LibvirtDriver.get_vcpu_total(),
+            'vcpus': host['vcpus'],
             'vcpus_used': self.get_vcpu_used(),
             'cpu_info': '{}',
             'disk_total': disk_usage.total,
@@ -471,9 +1159,7 @@ class DynamipsDriver(ComputeDriver):
         return self._gen_stats()
 
     def get_vcpu_used(self):
-        return sum(
-            map(lambda r: int(r.state == 'running'),
-                self._routers.values()))
+        return self._routers.count('running')
 
     # refresh_security_group_rules
     # refresh_security_group_members
@@ -533,10 +1219,24 @@ class DynamipsDriver(ComputeDriver):
 
         Note that this function takes an instance ID.
         """
-        # TODO: cXXXX show_hardware (?)
-        raise NotImplementedError()
+        return list(self._router_by_name(instance_name).os_nios)
 
-    # interface_stats
+    def interface_stats(self, instance_name, iface_id):
+        """
+        Return traffic counters of router interface as (rx_bytes,
+        rx_packets, rx_errs, rx_drop, tx_bytes, tx_packets, tx_errs,
+        tx_drop), like libvirt driver does. Counters are taken from the
+        last sweep of stats sampler, so they lag up to
+        dynamips_stats_interval seconds.
+        """
+        if iface_id not in self._router_by_name(instance_name).os_nios:
+            raise exception.NotFound("No interface %s on instance %s" %
+                                     (iface_id, instance_name))
+        counters = self._nio_stats.get(iface_id)
+        if counters is None:
+            return 0, 0, 0, 0, 0, 0, 0, 0
+        packets_in, packets_out, bytes_in, bytes_out = counters
+        return bytes_in, packets_in, 0, 0, bytes_out, packets_out, 0, 0
 
     def manage_image_cache(self, context):
         """
@@ -547,8 +1247,9 @@ class DynamipsDriver(ComputeDriver):
         related to other calls into the driver. The prime example is to clean
         the cache and remove images which are no longer of interest.
         """
-        # TODO: implement
-        pass
+        self._images.evict(
+            max_bytes=FLAGS.dynamips_image_cache_max_gb * GB,
+            max_age=FLAGS.dynamips_image_cache_max_age)
 
     # add_to_aggregate
     # remove_from_aggregate
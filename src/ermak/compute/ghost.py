@@ -0,0 +1,91 @@
+import os
+
+from eventlet import event
+from eventlet import semaphore
+
+MB = 1024 * 1024
+
+
+class GhostImages(object):
+    """
+    Reference counted ghost RAM files.
+
+    Routers of the same image, platform and RAM size map one ghost file
+    with IOS memory instead of keeping private copies. The file is
+    created for the first router and removed when the last one is gone.
+    Creation boots a router, so the lock is not held meanwhile; routers
+    asking for a ghost being created wait for it.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._ghosts = {}
+        self._creating = {}
+        self._lock = semaphore.Semaphore()
+
+    def _path(self, key):
+        image, platform, ram = key
+        name = "%s-%s-%s.ghost" % (os.path.basename(image), platform, ram)
+        return os.path.join(self._directory, name)
+
+    def acquire(self, key, create):
+        """
+        Get ghost file for key, calling create(path) if there is none.
+
+        :param key: (image path, platform, ram) tuple
+        """
+        while True:
+            with self._lock:
+                ghost = self._ghosts.get(key)
+                if ghost is not None:
+                    ghost['refs'] += 1
+                    return ghost['path']
+                creating = self._creating.get(key)
+                if creating is None:
+                    creating = self._creating[key] = event.Event()
+                    break
+            # raises if creation failed
+            creating.wait()
+        path = self._path(key)
+        try:
+            create(path)
+        except Exception as e:
+            # partially written file must not be mapped by next router
+            if os.path.exists(path):
+                os.unlink(path)
+            with self._lock:
+                del self._creating[key]
+            creating.send_exception(e)
+            raise
+        with self._lock:
+            self._ghosts[key] = {'path': path, 'refs': 1,
+                                 'size_mb': self._shared_mb(key)}
+            del self._creating[key]
+        creating.send(path)
+        return path
+
+    def release(self, key):
+        with self._lock:
+            ghost = self._ghosts.get(key)
+            if ghost is None:
+                return
+            ghost['refs'] -= 1
+            if ghost['refs'] <= 0:
+                del self._ghosts[key]
+                if os.path.exists(ghost['path']):
+                    os.unlink(ghost['path'])
+
+    def _shared_mb(self, key):
+        """
+        Size of IOS memory the ghost shares, about that of the unpacked
+        image; the rest of router RAM is private to each router
+        """
+        image, platform, ram = key
+        if not os.path.exists(image):
+            return 0
+        return min(os.path.getsize(image) / MB, ram)
+
+    def saved_mb(self):
+        """RAM not committed thanks to sharing: all IOS copies but one"""
+        return sum(g['size_mb'] * (g['refs'] - 1)
+                   for g in self._ghosts.itervalues())
@@ -0,0 +1,59 @@
+import json
+import os
+import re
+
+# dynamips reports candidates as "101 0x6026ffd4 [53]", values hit
+# between 50 and 60 times per sample are the ones dynagen recommends
+_CANDIDATE = re.compile(r'^1\d\d[ -](0x[0-9a-fA-F]+) \[(\d+)\]')
+GOOD_COUNTS = (50, 60)
+
+
+def parse_candidates(reply):
+    """
+    Parse reply of "vm get_idle_pc_prop"
+
+    :return list of (idle-pc, hit count) tuples
+    """
+    candidates = []
+    for line in reply:
+        match = _CANDIDATE.match(line)
+        if match:
+            candidates.append((match.group(1), int(match.group(2))))
+    return candidates
+
+
+def choose(candidates):
+    """Pick best idle-pc value, None if there are no candidates"""
+    if not candidates:
+        return None
+    low, high = GOOD_COUNTS
+    good = [c for c in candidates if low <= c[1] <= high]
+    if good:
+        # closest to the middle of recommended range
+        middle = (low + high) / 2.0
+        return min(good, key=lambda c: abs(c[1] - middle))[0]
+    return max(candidates, key=lambda c: c[1])[0]
+
+
+class IdlePCCache(object):
+    """Idle-PC values keyed by image checksum, persisted as JSON file"""
+
+    def __init__(self, path):
+        self._path = path
+        self._values = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self._values = json.load(f)
+
+    def get(self, checksum):
+        return self._values.get(checksum)
+
+    def set(self, checksum, value):
+        self._values[checksum] = value
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._values, f)
+        os.rename(tmp, self._path)
+
+    def __contains__(self, checksum):
+        return checksum in self._values
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+
+from eventlet import event
+from eventlet import tpool
+
+from nova import exception
+from nova.openstack.common import log as logging
+from nova.utils import ensure_tree
+from nova.virt import images
+
+from ermak.util import ios
+
+LOG = logging.getLogger("nova.virt.dynamips.imagecache")
+
+PART_SUFFIX = '.part'
+UNPACKED_SUFFIX = '.unpacked'
+META_SUFFIX = '.meta'
+
+
+def _md5(path):
+    digest = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ImageCache(object):
+    """
+    Images fetched from glance, shared by routers of this host.
+
+    Each image is downloaded once even if several routers ask for it at
+    the same time, verified against glance checksum and renamed into
+    place only when complete. Images used by live routers are never
+    evicted; the rest are removed least recently used first.
+
+    With unpack enabled, compressed IOS images get an uncompressed copy
+    next to them, so that dynamips does not decompress them at every boot.
+
+    Glance metadata of images is kept next to them too, so routers can be
+    restored without asking glance.
+    """
+
+    def __init__(self, directory, unpack=False):
+        self._directory = directory
+        self._unpack = unpack
+        self._not_compressed = set()
+        self._refs = defaultdict(int)
+        self._fetching = {}
+        ensure_tree(directory)
+
+    def path(self, image_ref):
+        return os.path.abspath(os.path.join(self._directory, image_ref))
+
+    def acquire(self, context, instance, checksum=None):
+        """Get path of instance image, fetching it if needed"""
+        image_ref = instance["image_ref"]
+        path = self._ensure(
+            image_ref,
+            lambda p: self._fetch(context, instance, p, checksum))
+        self._refs[image_ref] += 1
+        # modification time serves as last use time for eviction
+        os.utime(path, None)
+        if self._unpack and image_ref not in self._not_compressed:
+            if not ios.is_compressed(path):
+                self._not_compressed.add(image_ref)
+                return path
+            try:
+                return self._ensure(
+                    image_ref + UNPACKED_SUFFIX,
+                    lambda p: tpool.execute(ios.unpack, path, p))
+            except Exception:
+                LOG.exception("Can not unpack image %s, using it as is" %
+                              image_ref)
+                self._not_compressed.add(image_ref)
+        return path
+
+    def _ensure(self, name, create):
+        """Get path of cached file, single create(path) call makes it"""
+        path = self.path(name)
+        fetching = self._fetching.get(name)
+        if fetching is not None:
+            fetching.wait()
+        elif not os.path.exists(path):
+            fetching = self._fetching[name] = event.Event()
+            try:
+                create(path)
+                fetching.send(path)
+            except Exception as e:
+                fetching.send_exception(e)
+                raise
+            finally:
+                del self._fetching[name]
+        return path
+
+    def meta(self, image_ref):
+        """Saved glance metadata of image, None if there is none"""
+        path = self.path(image_ref + META_SUFFIX)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def save_meta(self, image_ref, image_meta):
+        path = self.path(image_ref + META_SUFFIX)
+        tmp = path + PART_SUFFIX
+        with open(tmp, 'w') as f:
+            # glance returns dates as datetime objects
+            json.dump(image_meta, f, default=str)
+        os.rename(tmp, path)
+
+    def release(self, image_ref):
+        if self._refs[image_ref] > 0:
+            self._refs[image_ref] -= 1
+        if not self._refs[image_ref]:
+            del self._refs[image_ref]
+
+    def _fetch(self, context, instance, path, checksum):
+        part = path + PART_SUFFIX
+        LOG.debug("Fetching image %s to %s" % (instance["image_ref"], path))
+        try:
+            images.fetch_to_raw(context, instance["image_ref"], part,
+                                instance["user_id"], instance["project_id"])
+            if checksum and _md5(part) != checksum:
+                raise exception.ImageUnacceptable(
+                    image_id=instance["image_ref"],
+                    reason="checksum mismatch")
+            os.rename(part, path)
+        finally:
+            if os.path.exists(part):
+                os.unlink(part)
+
+    def _entries(self):
+        """Cached images as (last use, size, image ref, files) tuples"""
+        files = defaultdict(list)
+        for name in os.listdir(self._directory):
+            files[name.split('.')[0]].append(
+                os.path.join(self._directory, name))
+        entries = []
+        for image_ref, paths in files.iteritems():
+            if any(name.startswith(image_ref) for name in self._fetching):
+                continue
+            stats = [os.stat(p) for p in paths]
+            entries.append((max(s.st_mtime for s in stats),
+                            sum(s.st_size for s in stats),
+                            image_ref, paths))
+        return sorted(entries)
+
+    def evict(self, max_bytes=None, max_age=None):
+        """
+        Remove unused images older than max_age seconds, then least
+        recently used ones until cache takes at most max_bytes.
+        """
+        entries = self._entries()
+        total = sum(e[1] for e in entries)
+        now = time.time()
+        for last_used, size, image_ref, paths in entries:
+            if image_ref in self._refs:
+                continue
+            expired = max_age and now - last_used > max_age
+            if not expired and not (max_bytes and total > max_bytes):
+                continue
+            LOG.info("Removing cached image %s" % image_ref)
+            for path in paths:
+                os.unlink(path)
+            total -= size
@@ -2,6 +2,7 @@
 
 import nova.context
 from nova.compute import aggregate_states
+from nova.compute import power_state
 from nova.compute.manager import publisher_id, wrap_instance_fault
 from nova import exception
 from nova import flags
@@ -17,10 +18,24 @@ LOG = logging.getLogger("nova.compute.manager")
 
 class ComputeManager(nova.compute.manager.ComputeManager):
 
+    def init_host(self):
+        """Restore routers in bulk before nova resumes them one by one"""
+        self.driver.init_host(host=self.host)
+        if FLAGS.resume_guests_state_on_host_boot:
+            context = nova.context.get_admin_context()
+            instances = [
+                i for i in self.db.instance_get_all_by_host(context, self.host)
+                if i['power_state'] == power_state.RUNNING]
+            self.driver.restore_instances(
+                context, instances,
+                lambda i: self._legacy_nw_info(
+                    self._get_instance_nw_info(context, i)))
+        super(ComputeManager, self).init_host()
+
     @exception.wrap_exception(notifier=notifier, publisher_id=publisher_id())
     @wrap_instance_fault
     def validate_console_port(self, ctxt, instance, port, console_type):
-        if console_type == 'ajaxterm':
+        if console_type in ('ajaxterm', 'websocket'):
             console_info = self.driver.get_web_console(instance)
         else:
             console_info = self.driver.get_vnc_console(instance)
@@ -40,6 +55,13 @@ class ComputeManager(nova.compute.manager.ComputeManager):
             connect_info['token'] = token
             connect_info['access_url'] = access_url
             return connect_info
+        elif console_type == 'websocket':
+            access_url = '%s?token=%s' % (FLAGS.websocket_console_base_url,
+                                          token)
+            connect_info = self.driver.get_websocket_console(instance)
+            connect_info['token'] = token
+            connect_info['access_url'] = access_url
+            return connect_info
         elif console_type == 'novnc':
             # For essex, novncproxy_base_url must include the full path
             # including the html file (like http://myhost/vnc_auto.html)
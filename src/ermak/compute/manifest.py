@@ -0,0 +1,43 @@
+import json
+import os
+
+from nova.utils import ensure_tree
+
+SUFFIX = '.json'
+
+
+class Manifests(object):
+    """
+    What is needed to rebuild router objects of a running hypervisor,
+    stored as JSON file per router.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        ensure_tree(directory)
+
+    def _path(self, name):
+        return os.path.join(self._directory, name + SUFFIX)
+
+    def save(self, name, manifest):
+        path = self._path(name)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.rename(tmp, path)
+
+    def load(self, name):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def delete(self, name):
+        path = self._path(name)
+        if os.path.exists(path):
+            os.unlink(path)
+
+    def names(self):
+        return [f[:-len(SUFFIX)] for f in os.listdir(self._directory)
+                if f.endswith(SUFFIX)]
@@ -0,0 +1,66 @@
+from array import array
+
+from nova.openstack.common import log as logging
+
+from ermak.util.dynamips import DynamipsError
+
+LOG = logging.getLogger("nova.virt.dynamips.niostats")
+
+# order of counters in "nio get_stats" reply
+PACKETS_IN, PACKETS_OUT, BYTES_IN, BYTES_OUT = range(4)
+FIELDS = 4
+
+
+def parse_nio_stats(reply):
+    """Parse reply of "nio get_stats": packets in/out, bytes in/out"""
+    return [int(v) for v in reply[-1][4:].split()[:FIELDS]]
+
+
+class NioStats(object):
+    """
+    Traffic counters of all NIOs of the host.
+
+    Each sweep asks every hypervisor for counters of all its NIOs with one
+    pipelined batch of "nio get_stats" commands and replaces the table:
+    an index of NIO names into a flat array with four counters per NIO.
+    """
+
+    def __init__(self):
+        self._index = {}
+        self._counters = array('L')
+
+    def __len__(self):
+        return len(self._index)
+
+    def sample(self, nios_by_shard):
+        """
+        :param nios_by_shard: list of (shard, NIO names) pairs
+        """
+        index = {}
+        counters = array('L')
+        for shard, names in nios_by_shard:
+            if not names:
+                continue
+            replies = shard.client.call_many(
+                ['nio get_stats %s' % name for name in names],
+                raise_errors=False)
+            for name, reply in zip(names, replies):
+                if isinstance(reply, DynamipsError):
+                    # NIO may be gone since names were taken
+                    continue
+                try:
+                    values = parse_nio_stats(reply)
+                except ValueError:
+                    LOG.warn("Unexpected stats of NIO %s: %s" % (name, reply))
+                    continue
+                index[name] = len(counters)
+                counters.extend(values)
+        self._index = index
+        self._counters = counters
+
+    def get(self, name):
+        """Counters of NIO as (packets in, packets out, bytes in, bytes out)"""
+        offset = self._index.get(name)
+        if offset is None:
+            return None
+        return tuple(self._counters[offset:offset + FIELDS])
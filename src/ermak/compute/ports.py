@@ -0,0 +1,97 @@
+import errno
+import json
+import os
+import socket
+from collections import deque
+
+from eventlet import semaphore
+
+
+def is_port_free(port, host=''):
+    """Check that nobody listens on the port by binding to it in-process"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.setblocking(0)
+        s.bind((host, port))
+        return True
+    except socket.error as e:
+        if e.errno in (errno.EADDRINUSE, errno.EACCES):
+            return False
+        raise
+    finally:
+        s.close()
+
+
+class PortPool(object):
+    """
+    Allocator of TCP ports from [start_port, end_port) range.
+
+    Free ports are kept in a FIFO free-list and busy ones in a bitmap, so
+    acquire pops candidates instead of scanning the range. Ports found
+    occupied by foreign processes are moved to the tail of the free-list.
+    Leases are saved to state_file, if given, and restored on start.
+    """
+
+    def __init__(self, start_port, end_port, state_file=None):
+        self._start_port = start_port
+        self._end_port = end_port
+        self._state_file = state_file
+        self._used = bytearray(end_port - start_port)
+        self._leases = {}
+        self._lock = semaphore.Semaphore()
+        self._load()
+        self._free = deque(port for port in xrange(start_port, end_port)
+                           if not self._is_used(port))
+
+    def _is_used(self, port):
+        return self._used[port - self._start_port]
+
+    def _mark(self, port, used):
+        self._used[port - self._start_port] = used
+
+    def _load(self):
+        if not self._state_file or not os.path.exists(self._state_file):
+            return
+        with open(self._state_file) as f:
+            leases = json.load(f)
+        for lease, port in leases.iteritems():
+            if self._start_port <= port < self._end_port:
+                self._leases[lease] = port
+                self._mark(port, 1)
+
+    def _save(self):
+        if not self._state_file:
+            return
+        tmp = self._state_file + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._leases, f)
+        os.rename(tmp, self._state_file)
+
+    def acquire(self, lease):
+        lease = str(lease)
+        with self._lock:
+            port = self._leases.get(lease)
+            if port:
+                return port
+            for _ in xrange(len(self._free)):
+                port = self._free.popleft()
+                if is_port_free(port):
+                    self._mark(port, 1)
+                    self._leases[lease] = port
+                    self._save()
+                    return port
+                self._free.append(port)
+        raise Exception("Can not find free port to bind")
+
+    def release(self, lease):
+        lease = str(lease)
+        with self._lock:
+            port = self._leases.pop(lease, None)
+            if port:
+                self._mark(port, 0)
+                self._free.append(port)
+                self._save()
+
+    def leases(self):
+        return dict(self._leases)
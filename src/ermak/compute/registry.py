@@ -0,0 +1,93 @@
+from collections import defaultdict
+
+
+class RouterRegistry(object):
+    """
+    Routers known to the driver, indexed by instance id, uuid and name.
+
+    Behaves like the plain ``{instance_id: router}`` dict it replaces, but
+    keeps secondary indexes, per-state counters and total RAM in sync, so
+    lookups by name and host stats do not have to scan every router.
+    """
+
+    def __init__(self):
+        self._by_id = {}
+        self._by_uuid = {}
+        self._by_name = {}
+        self._keys = {}
+        self._states = {}
+        self._state_counts = defaultdict(int)
+        self.ram_mb = 0
+
+    def add(self, instance, router):
+        instance_id = instance["id"]
+        if instance_id in self._by_id:
+            self.remove(instance_id)
+        self._by_id[instance_id] = router
+        self._by_uuid[instance["uuid"]] = instance_id
+        self._by_name[instance["name"]] = instance_id
+        self._keys[instance_id] = (instance["uuid"], instance["name"])
+        self.ram_mb += router.ram
+        self._update_state(instance_id, getattr(router, 'state', None))
+        router.os_state_listener = \
+            lambda r: self._update_state(instance_id, r.state)
+
+    def remove(self, instance_id):
+        router = self._by_id.pop(instance_id, None)
+        if router is None:
+            return None
+        uuid, name = self._keys.pop(instance_id)
+        del self._by_uuid[uuid]
+        del self._by_name[name]
+        self.ram_mb -= router.ram
+        self._update_state(instance_id, None)
+        del self._states[instance_id]
+        router.os_state_listener = None
+        return router
+
+    def _update_state(self, instance_id, state):
+        old_state = self._states.get(instance_id)
+        if old_state is not None:
+            self._state_counts[old_state] -= 1
+        if state is not None:
+            self._state_counts[state] += 1
+        self._states[instance_id] = state
+
+    def count(self, state):
+        """Number of routers currently in given dynamips state"""
+        return self._state_counts[state]
+
+    def by_uuid(self, uuid):
+        instance_id = self._by_uuid.get(uuid)
+        return self._by_id.get(instance_id)
+
+    def by_name(self, name):
+        instance_id = self._by_name.get(name)
+        return self._by_id.get(instance_id)
+
+    def get(self, instance_id, default=None):
+        return self._by_id.get(instance_id, default)
+
+    def __getitem__(self, instance_id):
+        return self._by_id[instance_id]
+
+    def __contains__(self, instance_id):
+        return instance_id in self._by_id
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id)
+
+    def keys(self):
+        return self._by_id.keys()
+
+    def values(self):
+        return self._by_id.values()
+
+    def itervalues(self):
+        return self._by_id.itervalues()
+
+    def names(self):
+        return self._by_name.keys()
@@ -0,0 +1,48 @@
+import time
+
+import eventlet
+
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger("nova.virt.dynamips.sampler")
+
+
+class StatsSampler(object):
+    """
+    Calls collect() every interval seconds in background green thread
+    and keeps its last result, so readers never wait for collection.
+    """
+
+    def __init__(self, collect, interval):
+        self._collect = collect
+        self._interval = interval
+        self._snapshot = None
+        self._thread = None
+        self.updated_at = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                LOG.exception("Can not collect host stats")
+            eventlet.sleep(self._interval)
+
+    def refresh(self):
+        self._snapshot = self._collect()
+        self.updated_at = time.time()
+
+    def snapshot(self):
+        """Last collected stats; collected now if there are none yet"""
+        if self._snapshot is None:
+            self.refresh()
+        return dict(self._snapshot)
@@ -0,0 +1,212 @@
+import os
+import subprocess
+
+import eventlet
+import psutil
+
+from nova import flags
+from nova.openstack.common import cfg
+from nova.openstack.common import log as logging
+from nova.utils import ensure_tree
+
+from ermak.util.dynamips import DynamipsClient, DynamipsError
+
+LOG = logging.getLogger("nova.virt.dynamips.shards")
+
+shard_opts = [
+    cfg.IntOpt('dynamips_shards',
+               default=0,
+               help='Number of local dynamips hypervisors to run, '
+                    '0 to use single one at dynamips_host:dynamips_port'),
+    cfg.StrOpt('dynamips_binary',
+               default='dynamips',
+               help='Path to dynamips executable'),
+    cfg.IntOpt('dynamips_shard_base_port',
+               default=7210,
+               help='Port of the first local hypervisor, next ones '
+                    'listen on subsequent ports'),
+    cfg.BoolOpt('dynamips_shard_pin_cpus',
+                default=False,
+                help='Pin each local hypervisor to its own CPU core'),
+    cfg.StrOpt('dynamips_shard_placement',
+               default='count',
+               help='How to choose hypervisor for new router: '
+                    '"count" for least routers, "cpu" for least CPU used'),
+    cfg.IntOpt('dynamips_reconnect_deadline',
+               default=60,
+               help='Seconds commands wait for lost hypervisor to be '
+                    'reconnected before failing'),
+]
+FLAGS = flags.FLAGS
+FLAGS.register_opts(shard_opts)
+
+# console ports of routers on different hypervisors must not overlap
+CONSOLE_PORTS_PER_SHARD = 1000
+# file in hypervisor working directory keeping its pid
+PID_FILE = 'dynamips.pid'
+
+
+def _cpu_percent(process):
+    if hasattr(process, 'cpu_percent'):
+        return process.cpu_percent(interval=None)
+    return process.get_cpu_percent(interval=None)
+
+
+class HypervisorShard(object):
+    """Dynamips hypervisor with routers placed on it"""
+
+    def __init__(self, index, host, port, process=None, cpu=None):
+        self.index = index
+        self.host = host
+        self.port = port
+        self.process = process
+        self.cpu = cpu
+        self.client = None
+        self.routers = set()
+        # pid of hypervisor left running by previous compute process
+        self.reused_pid = None
+        self._ps = None
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else self.reused_pid
+
+    def connect(self, timeout, connections):
+        self.client = DynamipsClient(
+            self.host, self.port, timeout, connections,
+            FLAGS.dynamips_reconnect_deadline)
+        self.client.baseconsole += self.index * CONSOLE_PORTS_PER_SHARD
+
+    def cpu_percent(self):
+        """CPU used by hypervisor since previous call"""
+        if self.pid is None:
+            return 0.0
+        try:
+            # psutil measures from previous call on the same object, so
+            # it is kept until hypervisor is started again
+            if self._ps is None or self._ps.pid != self.pid:
+                self._ps = psutil.Process(self.pid)
+                _cpu_percent(self._ps)
+            return _cpu_percent(self._ps)
+        except psutil.NoSuchProcess:
+            self._ps = None
+            return 0.0
+
+    def __repr__(self):
+        return "<HypervisorShard %d %s:%s pid=%s routers=%d>" % (
+            self.index, self.host, self.port, self.pid, len(self.routers))
+
+
+class HypervisorShards(object):
+    """
+    Hypervisors used by the driver: either single external one, or
+    dynamips_shards local processes started and supervised by the driver.
+    """
+
+    def __init__(self, host, port, timeout, connections):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._connections = connections
+        self.shards = []
+
+    def start(self):
+        if FLAGS.dynamips_shards <= 0:
+            if FLAGS.dynamips_shard_placement == 'cpu':
+                LOG.warn("CPU placement needs local hypervisors "
+                         "(dynamips_shards), placing by router count")
+            shard = HypervisorShard(0, self._host, self._port)
+            shard.connect(self._timeout, self._connections)
+            self.shards = [shard]
+            return
+        cpus = psutil.cpu_count() if hasattr(psutil, 'cpu_count') \
+            else psutil.NUM_CPUS
+        for index in xrange(FLAGS.dynamips_shards):
+            port = FLAGS.dynamips_shard_base_port + index
+            cpu = index % cpus if FLAGS.dynamips_shard_pin_cpus else None
+            shard = HypervisorShard(index, '127.0.0.1', port, cpu=cpu)
+            self._start_process(shard)
+            self.shards.append(shard)
+
+    def _start_process(self, shard):
+        try:
+            # hypervisor may survive compute restart, reuse it then
+            shard.connect(self._timeout, self._connections)
+            shard.reused_pid = self._read_pid(shard)
+            LOG.info("Using running hypervisor %s" % shard)
+            return
+        except DynamipsError:
+            pass
+        self._spawn(shard)
+        for attempt in xrange(50):
+            eventlet.sleep(0.1)
+            try:
+                shard.connect(self._timeout, self._connections)
+                LOG.info("Started hypervisor %s" % shard)
+                return
+            except DynamipsError:
+                if shard.process.poll() is not None:
+                    break
+        raise DynamipsError("Could not start hypervisor %s" % shard)
+
+    def _workdir(self, shard):
+        return os.path.join(FLAGS.instances_path, 'dynamips-%d' % shard.index)
+
+    def _read_pid(self, shard):
+        """Pid of running hypervisor spawned for shard, None if unknown"""
+        try:
+            with open(os.path.join(self._workdir(shard), PID_FILE)) as f:
+                pid = int(f.read())
+        except (IOError, ValueError):
+            LOG.warn("Pid of hypervisor %s is unknown, it will not be "
+                     "restarted if it exits" % shard)
+            return None
+        return pid if psutil.pid_exists(pid) else None
+
+    def _spawn(self, shard):
+        workdir = self._workdir(shard)
+        ensure_tree(workdir)
+        args = [FLAGS.dynamips_binary,
+                '-H', '%s:%d' % (shard.host, shard.port)]
+        if shard.cpu is not None:
+            args = ['taskset', '-c', str(shard.cpu)] + args
+        LOG.debug("Spawning process: %s" % args)
+        shard.process = subprocess.Popen(args, cwd=workdir)
+        shard.reused_pid = None
+        # taskset execs dynamips, so the pid is that of hypervisor
+        with open(os.path.join(workdir, PID_FILE), 'w') as f:
+            f.write(str(shard.process.pid))
+        # start CPU measurement of the new process
+        shard.cpu_percent()
+
+    def revive(self, shard):
+        """
+        Start local hypervisor again if its process has exited; its
+        client is kept, as routers refer to it
+        """
+        if shard.process is not None:
+            if shard.process.poll() is None:
+                return
+            LOG.warn("Hypervisor %s exited with code %s, restarting" %
+                     (shard, shard.process.returncode))
+        elif shard.reused_pid is not None:
+            if psutil.pid_exists(shard.reused_pid):
+                return
+            LOG.warn("Hypervisor %s exited, restarting" % shard)
+        else:
+            # external hypervisor, or one of unknown pid
+            return
+        self._spawn(shard)
+
+    def stop(self):
+        for shard in self.shards:
+            if shard.process and shard.process.poll() is None:
+                shard.process.terminate()
+
+    def place(self):
+        """Choose hypervisor for new router, preferring reachable ones"""
+        shards = [s for s in self.shards if s.client.online] or self.shards
+        if FLAGS.dynamips_shard_placement == 'cpu':
+            return min(shards,
+                       key=lambda s: (s.cpu_percent(), len(s.routers)))
+        return min(shards, key=lambda s: len(s.routers))
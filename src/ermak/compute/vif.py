@@ -1,3 +1,5 @@
+import time
+
 from lxml import etree
 from nova.openstack.common import cfg
 from nova import flags
@@ -14,6 +16,10 @@ linux_net_opts = [
     cfg.StrOpt('data_iface',
                default='eth0',
                help='interface for UDP channel VIF'),
+    cfg.IntOpt('data_iface_refresh_interval',
+               default=60,
+               help='Seconds known addresses of data_iface are trusted '
+                    'before they are read from the interface again'),
 ]
 FLAGS = flags.FLAGS
 FLAGS.register_opts(linux_net_opts)
@@ -25,31 +31,86 @@ def list_addresses(iface):
     addresses = ifaddresses(iface).get(AF_INET, [])
     return map(lambda x: x['addr'], addresses)
 
+
+# interface name to (time read, set of addresses)
+_addresses = {}
+
+
+def _load_addresses(iface):
+    _addresses[iface] = (time.time(), set(list_addresses(iface)))
+    return _addresses[iface][1]
+
+
+class AddressBatch(object):
+    """
+    Set of alias changes on one interface, applied by single
+    ``ip -batch`` call.
+
+    Known interface addresses are kept in memory and updated as commands
+    are queued, so has_address reflects the state after pending changes
+    without querying the interface again. They are read again after
+    data_iface_refresh_interval, and right after failed changes, to catch
+    up with changes made outside this process.
+    """
+
+    def __init__(self, iface):
+        self.iface = iface
+        self._commands = []
+        loaded = _addresses.get(iface)
+        if loaded is None or \
+                time.time() - loaded[0] > FLAGS.data_iface_refresh_interval:
+            self._view = _load_addresses(iface)
+        else:
+            self._view = loaded[1]
+
+    def has_address(self, address):
+        return address.split('/')[0] in self._view
+
+    def _queue(self, action, address, label):
+        cmd = ['addr', action, 'dev', self.iface, address]
+        if label:
+            cmd.extend(['label', self.iface + ":" + label])
+        self._commands.append(' '.join(cmd))
+
+    def add(self, address, label=None):
+        """
+            :param: address must be in format xx.xx.xx.xx/yy
+            :param: label will be transformed in iface:label
+        """
+        self._queue('add', address, label)
+        self._view.add(address.split('/')[0])
+        return self
+
+    def delete(self, address, label=None):
+        self._queue('del', address, label)
+        self._view.discard(address.split('/')[0])
+        return self
+
+    def apply(self):
+        if not self._commands:
+            return
+        commands, self._commands = self._commands, []
+        try:
+            utils.execute('ip', '-force', '-batch', '-',
+                          process_input='\n'.join(commands) + '\n',
+                          run_as_root=True)
+        except exception.ProcessExecutionError:
+            LOG.warning(_("Failed to apply some of aliases on '%s': %s"),
+                        self.iface, commands)
+            # view may be inconsistent now
+            self._view = _load_addresses(self.iface)
+
+
 def add_alias(iface, address, label=None):
     """
         :param: address must be in format xx.xx.xx.xx/yy
         :param: label will be transformed in iface:label
     """
-    try:
-        cmdline = ['ip', 'addr', 'add', 'dev', iface, address]
-        if label:
-            cmdline.extend(['label', iface + ":" + label])
-        utils.execute(*cmdline, run_as_root=True)
-    except exception.ProcessExecutionError:
-        LOG.warning(_(
-            "Failed to set alias '%s' on interface '%s'"),
-            (address, address))
+    AddressBatch(iface).add(address, label).apply()
+
 
 def delete_alias(iface, address, label=None):
-    try:
-        cmdline = ['ip', 'addr', 'del', 'dev', iface, address]
-        if label:
-            cmdline.extend(['label', iface + ":" + label])
-        utils.execute(*cmdline, run_as_root=True)
-    except exception.ProcessExecutionError:
-        LOG.warning(_(
-            "Failed to unset alias '%s' on interface '%s'"),
-            (address, address))
+    AddressBatch(iface).delete(address, label).apply()
 
 
 class LibvirtConfigUdpInterface(LibvirtConfigGuestDevice):
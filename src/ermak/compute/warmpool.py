@@ -0,0 +1,154 @@
+import eventlet
+
+from nova.openstack.common import log as logging
+
+LOG = logging.getLogger("nova.virt.dynamips.warmpool")
+
+MIN_RETRY = 1
+MAX_RETRY = 60
+
+
+def has_adapters(router, slots):
+    """
+    Whether router has adapters of given models, as dict of slot number to
+    model; None model stands for any adapter
+    """
+    for slot_id, model in slots.iteritems():
+        adapter = router.slot[slot_id]
+        if adapter is None or model and \
+                type(adapter).__name__ != model.replace('-', '_'):
+            return False
+    return True
+
+
+class WarmSpec(object):
+    """
+    Kind of routers to keep booted: flavor, image, how many, and network
+    adapters installed into them as dict of slot number to model, since
+    adapters can not be added to running router
+    """
+
+    def __init__(self, flavor, image_ref, count, ram, adapters=None):
+        self.flavor = flavor
+        self.image_ref = image_ref
+        self.count = count
+        self.ram = ram
+        self.adapters = adapters or {}
+
+    @property
+    def key(self):
+        return (self.flavor, self.image_ref,
+                tuple(sorted(self.adapters.items())))
+
+    @classmethod
+    def parse(cls, entry, ram_for_flavor):
+        """
+        Parse "flavor:image_ref:count" config entry, optionally followed
+        by ":slot=model,..." adapters, e.g. "c1.3640:ios:2:1=NM-1FE-TX"
+        """
+        adapters = {}
+        head, _, tail = entry.rpartition(':')
+        if '=' in tail:
+            for adapter in tail.split(','):
+                slot, model = adapter.split('=')
+                adapters[int(slot)] = model.strip()
+            entry = head
+        flavor, image_ref, count = entry.rsplit(':', 2)
+        return cls(flavor, image_ref, int(count), ram_for_flavor(flavor),
+                   adapters)
+
+    def __repr__(self):
+        adapters = ','.join('%s=%s' % a
+                            for a in sorted(self.adapters.items()))
+        return "<WarmSpec %s:%s x%d %s>" % (self.flavor, self.image_ref,
+                                            self.count, adapters)
+
+
+class WarmPool(object):
+    """
+    Booted idle routers ready to be claimed by spawn.
+
+    Routers are made by create(spec) callback in background green
+    thread; the pool is refilled after each claim or miss, as long as all
+    pooled routers fit into ram_budget megabytes. Failed creation is
+    retried with growing delay.
+    """
+
+    def __init__(self, specs, create, ram_budget):
+        self._specs = dict((s.key, s) for s in specs)
+        self._create = create
+        self._ram_budget = ram_budget
+        self._ready = dict((key, []) for key in self._specs)
+        self._refilling = False
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return sum(len(routers) for routers in self._ready.itervalues())
+
+    def ram_used(self):
+        return sum(self._specs[key].ram * len(routers)
+                   for key, routers in self._ready.iteritems())
+
+    def claim(self, flavor, image_ref, suitable=lambda r: True):
+        """
+        Take pooled router of given flavor and image
+
+        :param suitable: predicate telling if router fits the request
+        :return router or None
+        """
+        for key, routers in self._ready.iteritems():
+            if key[:2] != (flavor, image_ref):
+                continue
+            for r in routers:
+                if suitable(r):
+                    routers.remove(r)
+                    self.hits += 1
+                    self.start()
+                    return r
+        self.misses += 1
+        self.start()
+        return None
+
+    def forget(self, lost):
+        """Drop routers for which lost(router) is true, and refill"""
+        for routers in self._ready.itervalues():
+            routers[:] = [r for r in routers if not lost(r)]
+        self.start()
+
+    def start(self):
+        """Refill pool in background"""
+        if self._specs and not self._refilling:
+            self._refilling = True
+            eventlet.spawn_n(self._refill)
+
+    def _refill(self):
+        delay = MIN_RETRY
+        try:
+            while True:
+                spec = self._next_spec()
+                if spec is None:
+                    return
+                try:
+                    r = self._create(spec)
+                except Exception:
+                    LOG.exception("Can not create warm router %s, retrying "
+                                  "in %s s" % (spec, delay))
+                    eventlet.sleep(delay)
+                    delay = min(delay * 2, MAX_RETRY)
+                    continue
+                delay = MIN_RETRY
+                self._ready[spec.key].append(r)
+        finally:
+            self._refilling = False
+
+    def _next_spec(self):
+        for key, spec in self._specs.iteritems():
+            if len(self._ready[key]) < spec.count and \
+                    self.ram_used() + spec.ram <= self._ram_budget:
+                return spec
+        return None
+
+    def stats(self):
+        return {'ready': len(self), 'ram_mb': self.ram_used(),
+                'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,90 @@
+import eventlet
+
+from nova.openstack.common import log as logging
+
+from ermak.util.dynamips import DynamipsError
+
+LOG = logging.getLogger("nova.virt.dynamips.watchdog")
+
+MIN_RETRY = 0.5
+MAX_RETRY = 30
+
+
+class HypervisorWatchdog(object):
+    """
+    Sends keepalive to each hypervisor every interval seconds.
+
+    Hypervisor not answering within timeout is taken for dead or hung:
+    its client holds new commands, and it is reconnected in background
+    with growing delay, after revive(shard) restarts it if needed. Once
+    it answers again, recovered(shard) re-syncs its routers and held
+    commands go on.
+    """
+
+    def __init__(self, shards, interval, timeout, revive, recovered):
+        self._shards = shards
+        self._interval = interval
+        self._timeout = timeout
+        self._revive = revive
+        self._recovered = recovered
+        self._recovering = set()
+        self._thread = None
+        self.failures = 0
+        self.reconnects = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            eventlet.sleep(self._interval)
+            self.check_all()
+
+    def check_all(self):
+        for shard in self._shards:
+            if shard.index in self._recovering or self.check(shard):
+                continue
+            self.failures += 1
+            self._recovering.add(shard.index)
+            eventlet.spawn_n(self._recover, shard)
+
+    def check(self, shard):
+        try:
+            shard.client.probe(self._timeout)
+            return True
+        except DynamipsError as e:
+            LOG.warn("Hypervisor %s does not answer: %s" % (shard, e))
+            return False
+
+    def _recover(self, shard):
+        shard.client.mark_down()
+        try:
+            delay = MIN_RETRY
+            while True:
+                try:
+                    self._revive(shard)
+                except Exception:
+                    LOG.exception("Can not restart hypervisor %s" % shard)
+                if self.check(shard):
+                    break
+                eventlet.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY)
+            LOG.info("Hypervisor %s is back, re-syncing routers" % shard)
+            try:
+                self._recovered(shard)
+            except Exception:
+                LOG.exception("Can not re-sync routers of %s" % shard)
+            self.reconnects += 1
+        finally:
+            shard.client.mark_up()
+            self._recovering.discard(shard.index)
+
+    def stats(self):
+        return {'failures': self.failures, 'reconnects': self.reconnects,
+                'recovering': len(self._recovering)}
@@ -0,0 +1,35 @@
+import unittest
+
+from ermak.util.cache import TTLCache
+
+
+class TTLCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_is_dropped(self):
+        cache = TTLCache(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.set('c', 3)
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_entries_expire(self):
+        cache = TTLCache(2, 60)
+        cache.set('a', 1, ttl=-1)
+        cache.set('b', None)
+        self.assertEqual('missing', cache.get('a', 'missing'))
+        self.assertIn('b', cache)
+        self.assertIsNone(cache.get('b', 'missing'))
+
+    def test_delete(self):
+        cache = TTLCache(2, 60)
+        cache.set('a', 1)
+        cache.delete('a')
+        cache.delete('a')
+        self.assertNotIn('a', cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
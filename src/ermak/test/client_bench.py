@@ -0,0 +1,72 @@
+"""
+Per-command latency of DynamipsClient against FakeHypervisor.
+
+Each "spawn" is a sequence of commands similar to what dynagen sends
+for a router with 4 slots and 8 NIOs. Reports latency per command for
+sequential round-trips and for pipelined sends, for one spawn and for
+concurrent spawns sharing one or several connections.
+
+Usage: PYTHONPATH=src python src/ermak/test/client_bench.py
+"""
+import time
+
+import eventlet
+
+from ermak.test.fake_dynamips import FakeHypervisor
+from ermak.util.dynamips import DynamipsClient
+
+
+def spawn_commands(name):
+    commands = ['vm create %s 0 c2691' % name,
+                'vm set_ram %s 128' % name,
+                'vm set_nvram %s 128' % name,
+                'vm set_ios %s /tmp/c2691.image' % name]
+    for slot in range(4):
+        commands.append('vm slot_add_binding %s %d 0 NM-4T' % (name, slot))
+    for port in range(8):
+        nio = 'nio_udp_%s_%d' % (name, port)
+        commands.append('nio create_udp %s %d 10.0.0.1 %d' % (
+            nio, 10000 + port, 20000 + port))
+        commands.append('vm slot_add_nio_binding %s %d %d %s' % (
+            name, port / 2, port % 2, nio))
+    return commands
+
+
+def sequential(client, name):
+    for command in spawn_commands(name):
+        client.call(command)
+
+
+def pipelined(client, name):
+    client.call_many(spawn_commands(name))
+
+
+def measure(hypervisor, mode, spawns, pool_size):
+    hypervisor.vms.clear()
+    hypervisor.nios.clear()
+    client = DynamipsClient(hypervisor.host, hypervisor.port,
+                            timeout=10, pool_size=pool_size)
+    pool = eventlet.GreenPool()
+    started = time.time()
+    for i in range(spawns):
+        pool.spawn_n(mode, client, 'R%d' % i)
+    pool.waitall()
+    elapsed = time.time() - started
+    client.close_connections()
+    return elapsed / (spawns * len(spawn_commands('R')))
+
+
+def main():
+    for delay in (0, 0.001):
+        hypervisor = FakeHypervisor(delay=delay).start()
+        print "hypervisor work per command: %.1f ms" % (delay * 1000)
+        for spawns, pool_size in ((1, 1), (10, 1), (10, 4)):
+            for mode in (sequential, pipelined):
+                print "  %2d spawns, %d connections, %-10s %.3f ms/cmd" % (
+                    spawns, pool_size, mode.__name__,
+                    measure(hypervisor, mode, spawns, pool_size) * 1000)
+        hypervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
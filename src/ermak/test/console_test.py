@@ -0,0 +1,62 @@
+import unittest
+
+import eventlet
+
+from ermak.util.console import ConsoleTap, RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_keeps_last_bytes(self):
+        ring = RingBuffer(8)
+        ring.write('abc')
+        self.assertEqual('abc', ring.read())
+        ring.write('defgh')
+        self.assertEqual('abcdefgh', ring.read())
+        ring.write('ijk')
+        self.assertEqual('defghijk', ring.read())
+        ring.write('0123456789')
+        self.assertEqual('23456789', ring.read())
+
+    def test_zero_size(self):
+        ring = RingBuffer(0)
+        ring.write('abc')
+        self.assertEqual('', ring.read())
+
+
+class ConsoleTapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = eventlet.listen(('127.0.0.1', 0))
+        self.received = []
+        eventlet.spawn_n(self._serve)
+        self.tap = ConsoleTap('127.0.0.1', self.server.getsockname()[1], 16)
+
+    def tearDown(self):
+        self.tap.stop()
+        self.server.close()
+
+    def _serve(self):
+        conn, _addr = self.server.accept()
+        conn.sendall('\xff\xfb\x01Router>')
+        self.received.append(conn.recv(100))
+        conn.close()
+
+    def test_output_is_kept_and_input_sent(self):
+        seen = []
+        self.tap.subscribe(seen.append)
+        self.tap.start()
+        for _ in xrange(100):
+            if self.tap.connected and seen:
+                break
+            eventlet.sleep(0.01)
+        self.assertEqual('Router>', self.tap.output())
+        self.assertEqual(['Router>'], seen)
+        self.assertTrue(self.tap.send('en\r'))
+        eventlet.sleep(0.05)
+        self.assertEqual(['en\r'], self.received)
+        self.assertFalse(self.tap.connected)
+
+
+if __name__ == '__main__':
+    unittest.main()
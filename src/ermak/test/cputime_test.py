@@ -0,0 +1,71 @@
+import unittest
+
+from ermak.compute.cputime import RouterCpuTimes, parse_cpu_usage
+from ermak.test.fake_client import FakeClient, FakeShard
+from ermak.util.dynamips import DynamipsError
+
+
+class RouterCpuTimesTest(unittest.TestCase):
+
+    def test_parse_cpu_usage(self):
+        self.assertEqual(42, parse_cpu_usage(['100-42']))
+
+    def test_one_batch_per_hypervisor(self):
+        client = FakeClient({'r1': 3, 'r2': 5})
+        times = RouterCpuTimes()
+        times.sample([FakeShard(client, routers=['r1', 'r2', 'gone'])])
+        self.assertEqual(1, len(client.batches))
+        self.assertEqual(3, times.seconds('r1'))
+        self.assertEqual(5, times.seconds('r2'))
+        self.assertEqual(0, times.seconds('gone'))
+
+    def test_percent_between_samples(self):
+        client = FakeClient({'r1': 10})
+        shard = FakeShard(client, routers=['r1'])
+        times = RouterCpuTimes()
+        times.sample([shard])
+        self.assertEqual(0.0, times.percent('r1'))
+        client.replies['r1'] = 11
+        times._sampled_at -= 2
+        times.sample([shard])
+        self.assertAlmostEqual(50.0, times.percent('r1'), places=0)
+
+    def test_missing_router_does_not_disable_counters(self):
+        client = FakeClient({'r1': 10})
+        shard = FakeShard(client, routers=['r1'])
+        times = RouterCpuTimes()
+        times.sample([shard])
+        # the only router is deleted while it is sampled
+        del client.replies['r1']
+        times.sample([shard])
+        self.assertEqual(10, times.seconds('r1'))
+        client.replies['r1'] = 12
+        times.sample([shard])
+        self.assertEqual(12, times.seconds('r1'))
+
+    def test_lost_connection_keeps_counters(self):
+        client = FakeClient({'r1': 10})
+        shard = FakeShard(client, routers=['r1'])
+        times = RouterCpuTimes()
+
+        def lost(commands, raise_errors=True):
+            raise DynamipsError('Lost connection')
+        client.call_many = lost
+        times.sample([shard])
+        del client.call_many
+        times.sample([shard])
+        self.assertEqual(10, times.seconds('r1'))
+        self.assertEqual(set(), times._no_counters)
+
+    def test_unknown_command_switches_to_process_time(self):
+        client = FakeClient({})
+        client.call_many = lambda commands, raise_errors=True: [
+            DynamipsError('202-Unknown command')] * len(commands)
+        times = RouterCpuTimes()
+        times.sample([FakeShard(client, routers=['r1'])])
+        times.sample([FakeShard(client, routers=['r1'])])
+        self.assertEqual(1, len(times._no_counters))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+Throughput and latency of DynamipsDriver spawn, get_info and destroy
+against FakeHypervisor, at 10, 100 and 1000 routers.
+
+Unlike dynamips_test, commands really go over the hypervisor protocol,
+with FakeHypervisor adding per-verb latency. Address aliases are not
+programmed, so no root is needed.
+
+Needs Folsom nova (2012.2) and dynagen importable, as dynamips_test
+does. Usage: PYTHONPATH=src/:src/ermak python -mnova.testing.runner -s \
+           src/ermak/test/driver_bench.py
+
+No reference numbers are recorded here yet; they are to be taken on a
+host with that environment, together with the revision measured.
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import eventlet
+import nova.db
+from nova import context
+from nova import test
+
+from ermak.compute import dynamips
+from ermak.compute.vif import AddressBatch
+from ermak.test.fake_dynamips import FakeHypervisor
+
+SIZES = (10, 100, 1000)
+CONCURRENCY = 20
+IMAGE = 'cedef40a-ed67-4d10-800e-17455edce175'
+LATENCY = {'vm create': 0.002, 'vm start': 0.005,
+           'vm stop': 0.003, 'vm delete': 0.002}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def timed(func, *args):
+    started = time.time()
+    func(*args)
+    return time.time() - started
+
+
+def run(name, func, calls):
+    """Make calls concurrently, print throughput and latency"""
+    pool = eventlet.GreenPool(CONCURRENCY)
+    started = time.time()
+    latencies = list(pool.imap(lambda args: timed(func, *args), calls))
+    elapsed = time.time() - started
+    print "  %-8s %5d calls %8.1f/s  p50 %7.2f ms  p99 %7.2f ms" % (
+        name, len(latencies), len(latencies) / elapsed,
+        percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000)
+
+
+def network_info(index):
+    vifs = []
+    for slot in (1, 2):
+        port = 30000 + index * 4 + slot * 2
+        vifs.append({'meta': {
+            'quantum_udp_attrs': {'src-address': '127.0.0.1',
+                                  'dst-address': '127.0.0.1',
+                                  'prefix-len': 8,
+                                  'src-port': port,
+                                  'dst-port': port + 1},
+            'quantum_port_attrs': {'slot-id': slot,
+                                   'slot-model': 'NM-1FE-TX',
+                                   'port-id': 0}}})
+    return vifs
+
+
+class DynamipsDriverBench(test.TestCase):
+
+    def setUp(self):
+        super(DynamipsDriverBench, self).setUp()
+        self.hypervisor = FakeHypervisor(latency=LATENCY).start()
+        self.instances_path = tempfile.mkdtemp()
+        self.flags(dynamips_host=self.hypervisor.host,
+                   dynamips_port=self.hypervisor.port,
+                   dynamips_idlepc_auto=False,
+                   instances_path=self.instances_path,
+                   base_dir_name='base',
+                   data_iface='lo')
+        self.stubs.Set(AddressBatch, 'apply', lambda self: None)
+        self.ctxt = context.get_admin_context()
+        self.type_id = nova.db.instance_type_create(self.ctxt, {
+            'name': 'c1.3640', 'memory_mb': 128, 'vcpus': 1,
+            'root_gb': 0, 'ephemeral_gb': 0, 'flavorid': 42})['id']
+        self.driver = dynamips.DynamipsDriver()
+        # image is in cache already, so glance is not involved
+        with open(os.path.join(self.instances_path, 'base', IMAGE), 'w'):
+            pass
+        self.image_meta = {'id': IMAGE, 'checksum': None,
+                           'properties': {'dynamips_platform': 'c3600'}}
+
+    def tearDown(self):
+        self.hypervisor.stop()
+        shutil.rmtree(self.instances_path)
+        super(DynamipsDriverBench, self).tearDown()
+
+    def _instances(self, count):
+        return [nova.db.instance_create(self.ctxt, {
+            'image_ref': IMAGE, 'instance_type_id': self.type_id,
+            'project_id': 'fake', 'user_id': 'fake',
+            'memory_mb': 128, 'vcpus': 1}) for _ in xrange(count)]
+
+    def _spawn(self, instance, network_info):
+        self.driver.spawn(self.ctxt, instance, self.image_meta, [], None,
+                          network_info)
+
+    def test_spawn_get_info_destroy(self):
+        for size in SIZES:
+            instances = self._instances(size)
+            nets = [network_info(i) for i in xrange(size)]
+            print "\n%d routers, %d concurrent calls" % (size, CONCURRENCY)
+            run('spawn', self._spawn, zip(instances, nets))
+            self.assertEqual(size, len(self.hypervisor.vms))
+            run('get_info', self.driver.get_info,
+                [(i,) for i in instances])
+            run('destroy', self.driver.destroy, zip(instances, nets))
+            self.assertEqual({}, self.hypervisor.vms)
+            self.assertEqual({}, self.hypervisor.nios)
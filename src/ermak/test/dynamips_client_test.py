@@ -0,0 +1,187 @@
+import eventlet
+import unittest
+
+from dynagen.dynamips_lib import DynamipsError
+
+from ermak.test.fake_dynamips import FakeHypervisor
+from ermak.util.dynamips import DynamipsClient, green_send, \
+    rollback_commands
+
+
+class DynamipsClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hypervisor = FakeHypervisor(
+            latency={'vm start': 0.5, 'vm stop': 1},
+            errors={'vm create': '206-unable to create VM instance'})
+        self.hypervisor.add_vm('R1')
+        self.hypervisor.add_vm('R2')
+        self.hypervisor.start()
+        self.client = DynamipsClient(
+            self.hypervisor.host, self.hypervisor.port, timeout=5,
+            pool_size=2)
+
+    def tearDown(self):
+        self.client.close_connections()
+        self.hypervisor.stop()
+
+    def test_green_threads_progress_while_waiting_reply(self):
+        ticks = []
+
+        def ticker():
+            while True:
+                ticks.append(None)
+                eventlet.sleep(0.01)
+
+        thread = eventlet.spawn(ticker)
+        self.assertEqual(["100-VM 'R1' started"],
+                         self.client.call('vm start R1'))
+        thread.kill()
+        self.assertTrue(len(ticks) > 10)
+
+    def test_concurrent_commands_share_pool(self):
+        pool = eventlet.GreenPool()
+        replies = list(pool.imap(
+            self.client.call, ['vm set_ram R%d 128' % i for i in range(20)]))
+        self.assertEqual([['100-OK']] * 20, replies)
+        self.assertEqual(20, len(self.hypervisor.commands))
+        self.assertEqual(2, len(self.client._connections))
+
+    def test_slow_command_does_not_block_other_connection(self):
+        thread = eventlet.spawn(self.client.call, 'vm start R1')
+        eventlet.sleep(0)
+        with eventlet.Timeout(0.2):
+            self.client.call('vm set_ram R2 128')
+        thread.wait()
+
+    def test_pipelined_replies_match_requests(self):
+        replies = self.client.call_many(
+            ['vm set_ram R1 128', 'vm create R2 1 c2691', 'vm set_ram R2 64'],
+            raise_errors=False)
+        self.assertEqual(['100-OK'], replies[0])
+        self.assertTrue(isinstance(replies[1], DynamipsError))
+        self.assertEqual(['100-OK'], replies[2])
+        self.assertRaises(DynamipsError, self.client.call_many,
+                          ['vm set_ram R1 128', 'vm create R2 1 c2691'])
+
+    def test_deferred_commands_sent_on_exit(self):
+        with self.client.deferred():
+            green_send(self.client, 'vm set_ram R1 128')
+            green_send(self.client, 'vm set_nvram R1 128')
+            self.assertEqual([], self.hypervisor.commands)
+        self.assertEqual(['vm set_ram R1 128', 'vm set_nvram R1 128'],
+                         self.hypervisor.commands)
+
+    def test_error_reply(self):
+        self.assertRaises(
+            DynamipsError, self.client.call, 'vm create R1 0 c2691')
+        self.assertEqual(['100-OK'], self.client.call('vm set_ram R1 128'))
+
+    def test_timeout_reconnects(self):
+        self.assertRaises(
+            DynamipsError, self.client.call, 'vm stop R1', timeout=0.1)
+        self.assertEqual(['100-OK'], self.client.call('vm set_ram R1 128'))
+
+    def test_vm_list(self):
+        self.assertEqual(['R1', 'R2'], self.client.vm_list())
+
+    def test_nio_list(self):
+        self.client.call('nio create_udp nio_udp_R1_0_0 10001 h 10002')
+        self.assertEqual(['nio_udp_R1_0_0'], self.client.nio_list())
+
+    def test_vm_state_is_tracked(self):
+        self.client.call('vm start R2')
+        self.assertEqual(['100-2'], self.client.call('vm get_status R2'))
+        self.client.call('vm delete R2')
+        self.assertEqual(['R1'], self.client.vm_list())
+        self.assertRaises(
+            DynamipsError, self.client.call, 'vm get_status R2')
+
+    def test_injected_failures(self):
+        self.hypervisor.failures['vm suspend'] = 1
+        self.assertRaises(DynamipsError, self.client.call, 'vm suspend R1')
+
+    def test_failed_batch_is_rolled_back(self):
+        del self.hypervisor.errors['vm create']
+        self.hypervisor.errors['vm set_ios'] = '206-unable to set IOS'
+        with self.client.deferred():
+            green_send(self.client, 'vm create R3 3 c2691')
+            green_send(self.client, 'nio create_udp nio_r3 10001 h 10002')
+            green_send(self.client, 'vm slot_add_nio_binding R3 0 0 nio_r3')
+            green_send(self.client, 'nio create_udp nio_r1 10003 h 10004')
+            green_send(self.client, 'vm slot_add_nio_binding R1 0 0 nio_r1')
+            green_send(self.client, 'vm set_ios R3 c2691.image')
+            self.assertRaises(DynamipsError, self.client.flush)
+        self.assertEqual(['R1', 'R2'], sorted(self.hypervisor.vms))
+        self.assertEqual({}, self.hypervisor.nios)
+        self.assertEqual(['vm delete R3',
+                          'vm slot_remove_nio_binding R1 0 0',
+                          'nio delete nio_r1',
+                          'nio delete nio_r3'],
+                         self.hypervisor.commands[-4:])
+
+    def test_batch_cut_short_is_rolled_back(self):
+        del self.hypervisor.errors['vm create']
+        self.hypervisor.hung = 'vm set_ios'
+        client = DynamipsClient(
+            self.hypervisor.host, self.hypervisor.port, timeout=0.3)
+        try:
+            with client.deferred():
+                green_send(client, 'vm create R3 3 c2691')
+                green_send(client, 'nio create_udp nio_r3 10001 h 10002')
+                green_send(client, 'nio create_udp nio_r1 10003 h 10004')
+                green_send(client, 'vm slot_add_nio_binding R1 0 0 nio_r1')
+                green_send(client, 'vm set_ios R3 c2691.image')
+                self.assertRaises(DynamipsError, client.flush)
+        finally:
+            client.close_connections()
+            self.hypervisor.hung = False
+        self.assertEqual(['R1', 'R2'], sorted(self.hypervisor.vms))
+        self.assertEqual({}, self.hypervisor.nios)
+        self.assertTrue('vm slot_remove_nio_binding R1 0 0' in
+                        self.hypervisor.commands)
+
+    def test_rollback_skips_failed_commands(self):
+        commands = ['nio create_udp n1 1 h 2', 'nio create_udp n2 3 h 4']
+        replies = [DynamipsError('206-unable to create UDP NIO'),
+                   ['100-OK']]
+        self.assertEqual(['nio delete n2'],
+                         rollback_commands(commands, replies))
+
+    def test_commands_wait_while_hypervisor_is_down(self):
+        self.client.reconnect_deadline = 5
+        self.client.mark_down()
+        thread = eventlet.spawn(self.client.call, 'vm start R1')
+        eventlet.sleep(0.1)
+        self.assertEqual([], self.hypervisor.commands)
+        # recovering thread is not held
+        self.assertEqual(['R1', 'R2'], self.client.vm_list())
+        self.client.mark_up()
+        self.assertEqual(["100-VM 'R1' started"], thread.wait())
+
+    def test_commands_fail_after_reconnect_deadline(self):
+        self.client.reconnect_deadline = 0.1
+        self.client.mark_down()
+        thread = eventlet.spawn(self.client.call, 'vm start R1')
+        self.assertRaises(DynamipsError, thread.wait)
+        self.assertEqual([], self.hypervisor.commands)
+
+    def test_wait_online_without_deadline_fails_at_once(self):
+        self.client.reconnect_deadline = 5
+        self.client.mark_down()
+        thread = eventlet.spawn(self.client.wait_online, 0)
+        with eventlet.Timeout(0.5):
+            self.assertRaises(DynamipsError, thread.wait)
+
+    def test_connections_are_reopened_after_reconnect(self):
+        self.client.call('vm start R1')
+        sock = self.client._connections[0]._sock
+        self.client.mark_down()
+        self.client.mark_up()
+        self.client.call('vm stop R1')
+        self.assertFalse(sock is self.client._connections[0]._sock)
+
+    def test_probe_times_out_on_hung_hypervisor(self):
+        self.assertEqual(['100-0.2.8-RC2-fake'], self.client.probe(1))
+        self.hypervisor.hung = True
+        self.assertRaises(DynamipsError, self.client.probe, 0.1)
@@ -0,0 +1,37 @@
+"""Stand-ins for hypervisor client and shard of the driver"""
+from ermak.util.dynamips import DynamipsError
+
+
+class FakeClient(object):
+    """
+    Answers batches of commands about named objects, e.g.
+    "vm cpu_usage R1 0", from dict of object name to reply text; commands
+    about unknown names fail.
+    """
+
+    online = True
+
+    def __init__(self, replies):
+        self.replies = replies
+        self.batches = []
+
+    def call_many(self, commands, raise_errors=True):
+        self.batches.append(commands)
+        replies = []
+        for command in commands:
+            name = command.split()[2]
+            if name in self.replies:
+                replies.append(['100-%s' % self.replies[name]])
+            else:
+                replies.append(
+                    DynamipsError('206-unable to find \'%s\'' % name))
+        return replies
+
+
+class FakeShard(object):
+
+    def __init__(self, client, index=0, routers=(), pid=None):
+        self.client = client
+        self.index = index
+        self.routers = set(routers)
+        self.pid = pid
@@ -0,0 +1,170 @@
+"""Stand-in for dynamips hypervisor speaking its text protocol"""
+import random
+import socket
+
+import eventlet
+
+
+class FakeHypervisor(object):
+    """
+    Keeps VMs and NIOs created through it and answers commands about them
+    like dynamips does; replies "100-OK" to any other command.
+
+    :param latency: dict of verb (e.g. 'vm start') to seconds
+    :param errors: dict of verb to error line returned instead of OK
+    :param delay: seconds spent on any other command
+    :param failures: dict of verb to probability of failing it
+
+    Setting hung attribute makes it read commands but not answer them
+    until it is cleared; set to a verb, it hangs only on that command.
+    """
+
+    def __init__(self, latency=None, errors=None, delay=0, failures=None):
+        self.latency = latency or {}
+        self.delay = delay
+        self.errors = errors or {}
+        self.failures = failures or {}
+        self.commands = []
+        self.vms = {}
+        self.nios = {}
+        self.hung = False
+        self._server = eventlet.listen(('127.0.0.1', 0), backlog=128)
+        self.host, self.port = self._server.getsockname()
+        self._thread = None
+
+    def start(self):
+        self._thread = eventlet.spawn(self._serve)
+        return self
+
+    def stop(self):
+        if self._thread:
+            self._thread.kill()
+        self._server.close()
+
+    def _serve(self):
+        pool = eventlet.GreenPool()
+        while True:
+            try:
+                sock, addr = self._server.accept()
+            except socket.error:
+                # stopped before this thread got to run
+                return
+            pool.spawn_n(self._handle, sock)
+
+    def _handle(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        fd = sock.makefile('rw')
+        try:
+            for line in fd:
+                command = line.strip()
+                if not command:
+                    continue
+                for reply in self.handle(command):
+                    fd.write(reply + '\r\n')
+                fd.flush()
+        finally:
+            fd.close()
+            sock.close()
+
+    def add_vm(self, name, platform='c7200', state='stopped'):
+        self.vms[name] = {'platform': platform, 'state': state, 'cpu': 0}
+
+    def handle(self, command):
+        self.commands.append(command)
+        words = command.split()
+        verb = ' '.join(words[:2])
+        while self.hung is True or self.hung == verb:
+            eventlet.sleep(0.01)
+        latency = self.latency.get(verb, self.delay)
+        if latency:
+            eventlet.sleep(latency)
+        if verb in self.errors:
+            return [self.errors[verb]]
+        if random.random() < self.failures.get(verb, 0):
+            return ['209-injected failure of %s' % verb]
+        method = getattr(self, '_' + verb.replace(' ', '_'), None)
+        if method is None:
+            return ['100-OK']
+        return method(*words[2:])
+
+    def _vm(self, name):
+        return self.vms.get(name)
+
+    def _vm_create(self, name, instance_id, platform, *args):
+        if name in self.vms:
+            return ['206-unable to create VM instance \'%s\'' % name]
+        self.add_vm(name, platform)
+        return ['100-VM \'%s\' created' % name]
+
+    def _vm_delete(self, name, *args):
+        if self.vms.pop(name, None) is None:
+            return ['206-unable to find VM \'%s\'' % name]
+        return ['100-VM \'%s\' deleted' % name]
+
+    def _set_state(self, name, state, action):
+        vm = self._vm(name)
+        if vm is None:
+            return ['206-unable to find VM \'%s\'' % name]
+        vm['state'] = state
+        if state == 'running':
+            vm['cpu'] += 1
+        return ['100-VM \'%s\' %s' % (name, action)]
+
+    def _vm_start(self, name, *args):
+        return self._set_state(name, 'running', 'started')
+
+    def _vm_stop(self, name, *args):
+        return self._set_state(name, 'stopped', 'stopped')
+
+    def _vm_suspend(self, name, *args):
+        return self._set_state(name, 'suspended', 'suspended')
+
+    def _vm_resume(self, name, *args):
+        return self._set_state(name, 'running', 'resumed')
+
+    def _vm_rename(self, name, new_name, *args):
+        if name not in self.vms:
+            return ['206-unable to find VM \'%s\'' % name]
+        self.vms[new_name] = self.vms.pop(name)
+        return ['100-VM \'%s\' renamed to \'%s\'' % (name, new_name)]
+
+    def _vm_list(self, *args):
+        return ['101 %s (id %d, type %s)' % (name, i, vm['platform'])
+                for i, (name, vm) in enumerate(sorted(self.vms.items()))] + \
+            ['100-OK']
+
+    def _vm_get_status(self, name, *args):
+        vm = self._vm(name)
+        if vm is None:
+            return ['206-unable to find VM \'%s\'' % name]
+        code = {'stopped': 0, 'running': 2, 'suspended': 3}[vm['state']]
+        return ['100-%d' % code]
+
+    def _vm_cpu_usage(self, name, *args):
+        vm = self._vm(name)
+        if vm is None:
+            return ['206-unable to find VM \'%s\'' % name]
+        return ['100-%d' % vm['cpu']]
+
+    def _nio_create_udp(self, name, *args):
+        if name in self.nios:
+            return ['206-unable to create UDP NIO']
+        self.nios[name] = [0, 0, 0, 0]
+        return ['100-NIO \'%s\' created' % name]
+
+    def _nio_delete(self, name, *args):
+        if self.nios.pop(name, None) is None:
+            return ['206-unable to find NIO \'%s\'' % name]
+        return ['100-NIO \'%s\' deleted' % name]
+
+    def _nio_list(self, *args):
+        return ['101 %s' % name for name in sorted(self.nios)] + ['100-OK']
+
+    def _nio_get_stats(self, name, *args):
+        stats = self.nios.get(name)
+        if stats is None:
+            return ['206-unable to find NIO \'%s\'' % name]
+        return ['100-%d %d %d %d' % tuple(stats)]
+
+    def _hypervisor_version(self, *args):
+        return ['100-0.2.8-RC2-fake']
@@ -0,0 +1,89 @@
+import base64
+import os
+import unittest
+
+import eventlet
+from eventlet import wsgi
+
+from ermak.ajaxterm.gateway import ConsoleGateway, IDEM
+
+
+class FakeTap(object):
+
+    def __init__(self):
+        self.listeners = []
+        self.sent = []
+
+    def output(self):
+        return 'Router>'
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        self.listeners.remove(listener)
+
+    def send(self, data):
+        self.sent.append(data)
+        for listener in self.listeners:
+            listener(data)
+        return True
+
+
+class NullLog(object):
+
+    def write(self, data):
+        pass
+
+
+class ConsoleGatewayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tap = FakeTap()
+        self.gateway = ConsoleGateway('/nonexistent', 120)
+        self.key = self.gateway.register(self.tap)
+        self.sock = eventlet.listen(('127.0.0.1', 0))
+        self.server = eventlet.spawn(wsgi.server, self.sock, self.gateway,
+                                     log=NullLog())
+
+    def tearDown(self):
+        self.server.kill()
+
+    def test_sessions_share_tap(self):
+        session = self.gateway._session(self.key)
+        self.assertIn('Router&gt;', session.update('a'))
+        self.assertEqual(IDEM, session.update('a'))
+        self.assertIn('Router&gt;en', session.update('b', 'en'))
+        self.assertEqual(['en'], self.tap.sent)
+        self.gateway.unregister(self.key)
+        self.assertEqual([], self.tap.listeners)
+
+    def test_websocket_bridge(self):
+        conn = eventlet.connect(self.sock.getsockname())
+        conn.sendall("GET /%s/websocket HTTP/1.1\r\n"
+                     "Host: localhost\r\n"
+                     "Upgrade: websocket\r\n"
+                     "Connection: Upgrade\r\n"
+                     "Sec-WebSocket-Key: %s\r\n"
+                     "Sec-WebSocket-Version: 13\r\n\r\n" %
+                     (self.key, base64.b64encode(os.urandom(16))))
+        reply = ''
+        while not reply.endswith('Router>'):
+            reply += conn.recv(4096)
+        self.assertTrue(reply.startswith('HTTP/1.1 101'))
+        # masked text frame "en"
+        mask = '\x01\x02\x03\x04'
+        conn.sendall('\x81\x82' + mask + ''.join(
+            chr(ord(c) ^ ord(mask[i])) for i, c in enumerate('en')))
+        self.assertEqual('\x81\x02en', conn.recv(4096))
+        self.assertEqual(['en'], self.tap.sent)
+        conn.close()
+
+    def test_unknown_key(self):
+        conn = eventlet.connect(self.sock.getsockname())
+        conn.sendall("GET /nokey/u HTTP/1.0\r\n\r\n")
+        self.assertTrue(conn.recv(4096).startswith('HTTP/1.1 404'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import eventlet
+
+from ermak.compute.ghost import GhostImages, MB
+
+
+class GhostImagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ghosts = GhostImages(self.tmpdir)
+        self.created = []
+        self.image = os.path.join(self.tmpdir, 'c2691.image')
+        with open(self.image, 'w') as f:
+            f.write('\0' * 2 * MB)
+        self.key = (self.image, 'c2691', 128)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def create(self, path):
+        self.created.append(path)
+        # ghost file maps whole router RAM
+        with open(path, 'w') as f:
+            f.truncate(128 * MB)
+
+    def test_ghost_created_once_and_removed_with_last_router(self):
+        path = self.ghosts.acquire(self.key, self.create)
+        self.assertEqual(path, self.ghosts.acquire(self.key, self.create))
+        self.assertEqual([path], self.created)
+        self.assertEqual(2, self.ghosts.saved_mb())
+        self.ghosts.release(self.key)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(0, self.ghosts.saved_mb())
+        self.ghosts.release(self.key)
+        self.assertFalse(os.path.exists(path))
+
+    def test_keys_do_not_share_ghosts(self):
+        other = (self.image, 'c2691', 256)
+        self.assertNotEqual(self.ghosts.acquire(self.key, self.create),
+                            self.ghosts.acquire(other, self.create))
+        self.assertEqual(2, len(self.created))
+
+    def slow_create(self, path):
+        eventlet.sleep(0.1)
+        self.create(path)
+
+    def test_concurrent_acquire_creates_once(self):
+        pool = eventlet.GreenPool()
+        paths = list(pool.imap(
+            lambda i: self.ghosts.acquire(self.key, self.slow_create),
+            range(5)))
+        self.assertEqual(1, len(set(paths)))
+        self.assertEqual(1, len(self.created))
+        self.assertEqual(8, self.ghosts.saved_mb())
+
+    def test_creation_does_not_block_other_keys(self):
+        other = (self.image, 'c2691', 256)
+        self.ghosts.acquire(other, self.create)
+        thread = eventlet.spawn(self.ghosts.acquire, self.key,
+                                self.slow_create)
+        eventlet.sleep(0)
+        with eventlet.Timeout(0.05):
+            self.ghosts.release(other)
+        self.assertTrue(thread.wait())
+
+    def test_failed_creation_is_raised_to_waiters(self):
+        def fail(path):
+            eventlet.sleep(0.05)
+            raise IOError("no space")
+        first = eventlet.spawn(self.ghosts.acquire, self.key, fail)
+        eventlet.sleep(0)
+        second = eventlet.spawn(self.ghosts.acquire, self.key, self.create)
+        self.assertRaises(IOError, first.wait)
+        self.assertRaises(IOError, second.wait)
+        self.assertEqual(self.ghosts.acquire(self.key, self.create),
+                         self.created[0])
+
+    def test_partial_ghost_file_is_removed(self):
+        def fail(path):
+            with open(path, 'w') as f:
+                f.write('\0' * MB)
+            raise IOError("hypervisor is gone")
+        self.assertRaises(IOError, self.ghosts.acquire, self.key, fail)
+        self.assertEqual(['c2691.image'], os.listdir(self.tmpdir))
+
+    def test_saved_memory_is_image_size(self):
+        self.ghosts.acquire(self.key, self.create)
+        self.ghosts.acquire(self.key, self.create)
+        self.ghosts.acquire(self.key, self.create)
+        self.assertEqual(4, self.ghosts.saved_mb())
@@ -0,0 +1,50 @@
+"""
+Host CPU used by idle routers before and after applying idle-pc.
+
+Needs a real dynamips hypervisor and an IOS image:
+
+  PYTHONPATH=src python src/ermak/test/idlepc_bench.py \\
+      127.0.0.1:7200 c2691 /path/to/c2691.image 10
+"""
+import sys
+import time
+
+import psutil
+
+from ermak.compute import idlepc
+from ermak.util.dynamips import DynamipsClient
+
+BOOT_TIME = 90
+SAMPLE_TIME = 30
+
+
+def main(address, platform, image, count):
+    host, port = address.split(':')
+    client = DynamipsClient(host, int(port), timeout=600)
+    names = ['idlepc_bench_%d' % i for i in range(count)]
+    for i, name in enumerate(names):
+        client.call_many([
+            'vm create %s %d %s' % (name, i, platform),
+            'vm set_ios %s %s' % (name, image),
+            'vm set_ram %s 128' % name,
+            'vm set_con_tcp_port %s %d' % (name, 3000 + i)])
+    try:
+        for name in names:
+            client.call('vm start %s' % name)
+        time.sleep(BOOT_TIME)
+        before = psutil.cpu_percent(interval=SAMPLE_TIME)
+        value = idlepc.choose(idlepc.parse_candidates(
+            client.call('vm get_idle_pc_prop %s 0' % names[0])))
+        for name in names:
+            client.call('vm set_idle_pc_online %s 0 %s' % (name, value))
+        after = psutil.cpu_percent(interval=SAMPLE_TIME)
+        print "%d idle routers: host CPU %.1f%% without idle-pc, " \
+              "%.1f%% with idle-pc %s" % (count, before, after, value)
+    finally:
+        for name in names:
+            client.call_many(['vm stop %s' % name, 'vm delete %s' % name],
+                             raise_errors=False)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]))
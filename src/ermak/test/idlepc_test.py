@@ -0,0 +1,40 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ermak.compute import idlepc
+
+REPLY = ['101 0x60606f54 [34]',
+         '101 0x6026ffd4 [53]',
+         '101 0x60270c80 [59]',
+         '101 0x6000a1b0 [71]',
+         '100-OK']
+
+
+class IdlePCTest(unittest.TestCase):
+
+    def test_parse_candidates(self):
+        self.assertEqual(
+            [('0x60606f54', 34), ('0x6026ffd4', 53),
+             ('0x60270c80', 59), ('0x6000a1b0', 71)],
+            idlepc.parse_candidates(REPLY))
+        self.assertEqual([], idlepc.parse_candidates(['100-OK']))
+
+    def test_choose_prefers_recommended_range(self):
+        candidates = idlepc.parse_candidates(REPLY)
+        self.assertEqual('0x6026ffd4', idlepc.choose(candidates))
+        self.assertEqual('0x6000a1b0', idlepc.choose(
+            [('0x60606f54', 34), ('0x6000a1b0', 71)]))
+        self.assertIsNone(idlepc.choose([]))
+
+    def test_cache_is_persisted(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'idlepc.json')
+            idlepc.IdlePCCache(path).set('abc', '0x6026ffd4')
+            cache = idlepc.IdlePCCache(path)
+            self.assertTrue('abc' in cache)
+            self.assertEqual('0x6026ffd4', cache.get('abc'))
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from ermak.util import ios
+
+LOADER = '\x7fELF' + '\0' * 1020
+
+
+class IosUnpackTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.image = os.path.join(self.tmpdir, 'c2691.image')
+        self.target = os.path.join(self.tmpdir, 'c2691.unpacked')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_unpack_compressed_image(self):
+        payload = '\x7fELF' + 'IOS' * 10000
+        with open(self.image, 'wb') as f:
+            f.write(LOADER)
+            archive = zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED)
+            archive.writestr('C2691-ADVENTERPRISEK9-M', payload)
+            archive.close()
+        self.assertTrue(ios.is_compressed(self.image))
+        self.assertTrue(ios.unpack(self.image, self.target))
+        with open(self.target, 'rb') as f:
+            self.assertEqual(payload, f.read())
+
+    def test_uncompressed_image_is_left_alone(self):
+        with open(self.image, 'wb') as f:
+            f.write(LOADER)
+        self.assertFalse(ios.is_compressed(self.image))
+        self.assertFalse(ios.unpack(self.image, self.target))
+        self.assertFalse(os.path.exists(self.target))
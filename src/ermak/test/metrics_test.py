@@ -0,0 +1,52 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ermak.util.metrics import Histogram, Metrics
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for _ in xrange(99):
+            histogram.add(0.001)
+        histogram.add(2)
+        self.assertEqual(100, histogram.count)
+        self.assertTrue(0.001 <= histogram.percentile(50) < 0.002)
+        self.assertTrue(0.001 <= histogram.percentile(99) < 0.002)
+        self.assertTrue(2 <= histogram.percentile(100) < 4)
+        self.assertEqual(2000, histogram.as_dict()['max_ms'])
+
+    def test_dump(self):
+        metrics = Metrics()
+        with metrics.timer('spawn.image'):
+            pass
+        metrics.observe('dynamips.vm start', 0.5)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'stats.json')
+            metrics.write(path)
+            with open(path) as f:
+                dump = json.load(f)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(['dynamips.vm start', 'spawn.image'], sorted(dump))
+        self.assertEqual(1, dump['spawn.image']['count'])
+
+    def test_sources_are_dumped(self):
+        metrics = Metrics()
+        metrics.observe('spawn.image', 0.5)
+        requests = []
+        metrics.add_source('proxy.upstreams',
+                           lambda: {'host:80': {'requests': len(requests)}})
+        requests.append(1)
+        dump = metrics.dump()
+        self.assertEqual(1, dump['proxy.upstreams']['host:80']['requests'])
+        self.assertEqual(1, dump['spawn.image']['count'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from ermak.compute.niostats import NioStats, parse_nio_stats
+from ermak.test.fake_client import FakeClient, FakeShard
+
+
+class NioStatsTest(unittest.TestCase):
+
+    def test_parse_nio_stats(self):
+        self.assertEqual([1, 2, 64, 128],
+                         parse_nio_stats(['100-1 2 64 128']))
+
+    def test_one_batch_per_hypervisor(self):
+        first = FakeClient({'nio_udp1': '1 2 3 4'})
+        second = FakeClient({'nio_udp2': '5 6 7 8'})
+        stats = NioStats()
+        stats.sample([(FakeShard(first), ['nio_udp1', 'gone']),
+                      (FakeShard(second), ['nio_udp2'])])
+        self.assertEqual(1, len(first.batches))
+        self.assertEqual(1, len(second.batches))
+        self.assertEqual(2, len(stats))
+        self.assertEqual((1, 2, 3, 4), stats.get('nio_udp1'))
+        self.assertEqual((5, 6, 7, 8), stats.get('nio_udp2'))
+        self.assertIsNone(stats.get('gone'))
+
+    def test_sweep_replaces_table(self):
+        client = FakeClient({'nio_udp1': '1 1 1 1'})
+        stats = NioStats()
+        stats.sample([(FakeShard(client), ['nio_udp1'])])
+        stats.sample([(FakeShard(client), [])])
+        self.assertIsNone(stats.get('nio_udp1'))
+
+
+if __name__ == '__main__':
+    unittest.main()
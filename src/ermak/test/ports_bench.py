@@ -0,0 +1,77 @@
+"""
+Benchmark of console port allocation.
+
+The legacy allocator scanned the range from its start and forked a
+netcat probe for every candidate port. Here the probe is emulated by a
+python subprocess connecting to the port, since only the process spawn
+cost matters. Part of the range is occupied by listening sockets.
+
+Usage: PYTHONPATH=src python src/ermak/test/ports_bench.py
+"""
+import socket
+import subprocess
+import sys
+import time
+
+from ermak.compute.ports import PortPool
+
+START, END = 20000, 22000
+PROBE = "import socket, sys; " \
+        "sys.exit(socket.socket().connect_ex(('localhost', %d)) != 0)"
+
+
+def legacy_is_port_free(port):
+    return subprocess.call(
+        [sys.executable, '-c', PROBE % port], close_fds=True) != 0
+
+
+class LegacyPortPool(object):
+
+    def __init__(self, start_port, end_port):
+        self._ports = {}
+        self._leases = {}
+        self._start_port = start_port
+        self._end_port = end_port
+
+    def acquire(self, lease):
+        for port in xrange(self._start_port, self._end_port):
+            if port not in self._ports and legacy_is_port_free(port):
+                self._ports[port] = lease
+                self._leases[lease] = port
+                return port
+        raise Exception("Can not find free port to bind")
+
+
+def occupy(count):
+    sockets = []
+    for port in xrange(START, START + count):
+        s = socket.socket()
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(('', port))
+        s.listen(64)
+        sockets.append(s)
+    return sockets
+
+
+def measure(pool, leases):
+    started = time.time()
+    for lease in xrange(leases):
+        pool.acquire(lease)
+    return (time.time() - started) / leases
+
+
+def main():
+    busy = occupy(200)
+    try:
+        for name, pool, leases in (
+                ('legacy', LegacyPortPool(START, END), 5),
+                ('bitmap', PortPool(START, END), 1000)):
+            print "%s: %.3f ms per acquire with %d busy ports" % (
+                name, measure(pool, leases) * 1000, len(busy))
+    finally:
+        for s in busy:
+            s.close()
+
+
+if __name__ == '__main__':
+    main()
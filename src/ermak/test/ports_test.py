@@ -0,0 +1,44 @@
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+from ermak.compute.ports import PortPool, is_port_free
+
+
+class PortPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.state = os.path.join(self.tmpdir, 'ports.json')
+        self.start = 21000
+        self.busy = socket.socket()
+        self.busy.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.busy.bind(('', self.start))
+        self.busy.listen(1)
+
+    def tearDown(self):
+        self.busy.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_skips_busy_ports(self):
+        self.assertFalse(is_port_free(self.start))
+        pool = PortPool(self.start, self.start + 3)
+        self.assertEqual(self.start + 1, pool.acquire(1))
+        self.assertEqual(self.start + 2, pool.acquire(2))
+        self.assertEqual(self.start + 1, pool.acquire(1))
+        self.assertRaises(Exception, pool.acquire, 3)
+
+    def test_release_returns_port(self):
+        pool = PortPool(self.start + 1, self.start + 2)
+        port = pool.acquire(1)
+        pool.release(1)
+        self.assertEqual(port, pool.acquire(2))
+
+    def test_leases_survive_restart(self):
+        pool = PortPool(self.start + 1, self.start + 10, self.state)
+        port = pool.acquire("instance-1")
+        pool = PortPool(self.start + 1, self.start + 10, self.state)
+        self.assertEqual({"instance-1": port}, pool.leases())
+        self.assertNotEqual(port, pool.acquire("instance-2"))
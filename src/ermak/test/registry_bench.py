@@ -0,0 +1,59 @@
+"""
+Micro-benchmark for router lookups in DynamipsDriver.
+
+Compares the former linear scan over all routers with RouterRegistry
+indexes, emulating one periodic sync pass which calls get_info for
+every instance on the host.
+
+Usage: PYTHONPATH=src python src/ermak/test/registry_bench.py
+"""
+import timeit
+
+from ermak.compute.registry import RouterRegistry
+
+
+class FakeRouter(object):
+
+    def __init__(self, name, state):
+        self.os_name = name
+        self.state = state
+        self.ram = 128
+
+
+def build(count):
+    routers = {}
+    registry = RouterRegistry()
+    for i in xrange(count):
+        inst = {"id": i, "uuid": "uuid-%d" % i, "name": "instance-%08x" % i}
+        r = FakeRouter(inst["name"], ('running', 'stopped')[i % 2])
+        routers[i] = r
+        registry.add(inst, r)
+    return routers, registry
+
+
+def linear_sync(routers):
+    for name in [r.os_name for r in routers.itervalues()]:
+        filter(lambda r: r.os_name == name, routers.itervalues())[0]
+    sum(map(lambda r: int(r.state == 'running'), routers.values()))
+
+
+def indexed_sync(registry):
+    for name in registry.names():
+        registry.by_name(name)
+    registry.count('running')
+
+
+def main():
+    for count in (1000, 10000):
+        routers, registry = build(count)
+        repeat = 1 if count > 1000 else 3
+        linear = min(timeit.repeat(
+            lambda: linear_sync(routers), number=1, repeat=repeat))
+        indexed = min(timeit.repeat(
+            lambda: indexed_sync(registry), number=1, repeat=3))
+        print "%6d routers: linear %9.3f ms, indexed %7.3f ms, x%.0f" % (
+            count, linear * 1000, indexed * 1000, linear / indexed)
+
+
+if __name__ == '__main__':
+    main()
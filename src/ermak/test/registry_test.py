@@ -0,0 +1,65 @@
+import unittest
+
+from ermak.compute.registry import RouterRegistry
+
+
+class FakeRouter(object):
+
+    os_state_listener = None
+
+    def __init__(self, state='stopped', ram=128):
+        self.state = state
+        self.ram = ram
+
+    def set_state(self, state):
+        self.state = state
+        self.os_state_listener(self)
+
+
+def instance(i):
+    return {"id": i, "uuid": "uuid-%d" % i, "name": "instance-%08x" % i}
+
+
+class RouterRegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = RouterRegistry()
+        self.routers = [FakeRouter() for _ in range(3)]
+        for i, r in enumerate(self.routers):
+            self.registry.add(instance(i), r)
+
+    def test_lookup_by_all_keys(self):
+        r = self.routers[1]
+        self.assertIs(self.registry[1], r)
+        self.assertIs(self.registry.by_uuid("uuid-1"), r)
+        self.assertIs(self.registry.by_name("instance-00000001"), r)
+        self.assertEqual(3, len(self.registry))
+
+    def test_remove_drops_all_indexes(self):
+        self.assertIs(self.routers[2], self.registry.remove(2))
+        self.assertNotIn(2, self.registry)
+        self.assertIsNone(self.registry.by_uuid("uuid-2"))
+        self.assertIsNone(self.registry.by_name("instance-00000002"))
+        self.assertEqual(2, self.registry.count('stopped'))
+        self.assertEqual(256, self.registry.ram_mb)
+        self.assertIsNone(self.registry.remove(2))
+        self.assertEqual(256, self.registry.ram_mb)
+
+    def test_state_counts_follow_routers(self):
+        self.routers[0].set_state('running')
+        self.routers[1].set_state('running')
+        self.assertEqual(2, self.registry.count('running'))
+        self.assertEqual(1, self.registry.count('stopped'))
+        self.routers[1].set_state('suspended')
+        self.registry.remove(0)
+        self.assertEqual(0, self.registry.count('running'))
+        self.assertEqual(1, self.registry.count('suspended'))
+
+    def test_re_adding_instance_replaces_router(self):
+        new = FakeRouter('running', ram=64)
+        self.registry.add(instance(0), new)
+        self.assertEqual(320, self.registry.ram_mb)
+        self.assertIs(new, self.registry.by_name("instance-00000000"))
+        self.assertEqual(3, len(self.registry))
+        self.assertEqual(1, self.registry.count('running'))
+        self.assertEqual(2, self.registry.count('stopped'))
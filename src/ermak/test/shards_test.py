@@ -0,0 +1,77 @@
+import subprocess
+import sys
+import time
+
+from nova import test
+
+from ermak.compute.shards import HypervisorShard, HypervisorShards
+from ermak.test.fake_client import FakeClient
+
+
+class HypervisorShardsTest(test.TestCase):
+
+    def setUp(self):
+        super(HypervisorShardsTest, self).setUp()
+        self.flags(dynamips_shard_placement='cpu')
+        self.shards = HypervisorShards('127.0.0.1', 7200, 5, 1)
+        busy = HypervisorShard(0, '127.0.0.1', 7210)
+        busy.process = subprocess.Popen(
+            [sys.executable, '-c', 'while True: pass'])
+        idle = HypervisorShard(1, '127.0.0.1', 7211)
+        idle.process = subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(60)'])
+        self.shards.shards = [busy, idle]
+        for shard in self.shards.shards:
+            shard.client = FakeClient({})
+
+    def tearDown(self):
+        for shard in self.shards.shards:
+            if shard.process is None:
+                continue
+            shard.process.kill()
+            shard.process.wait()
+        super(HypervisorShardsTest, self).tearDown()
+
+    def test_busy_hypervisor_is_skipped(self):
+        busy, idle = self.shards.shards
+        # fewer routers would win placement by count
+        idle.routers.update(['R1', 'R2'])
+        self.shards.place()
+        time.sleep(0.5)
+        self.assertTrue(self.shards.place() is idle)
+
+    def test_measurement_restarts_with_process(self):
+        busy = self.shards.shards[0]
+        busy.cpu_percent()
+        ps = busy._ps
+        busy.process.kill()
+        busy.process.wait()
+        busy.process = subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(60)'])
+        busy.cpu_percent()
+        self.assertFalse(busy._ps is ps)
+
+    def test_offline_hypervisor_is_skipped(self):
+        self.flags(dynamips_shard_placement='count')
+        busy, idle = self.shards.shards
+        idle.routers.update(['R1', 'R2'])
+        busy.client.online = False
+        self.assertTrue(self.shards.place() is idle)
+
+    def test_exited_reused_hypervisor_is_restarted(self):
+        busy = self.shards.shards[0]
+        busy.process.kill()
+        busy.process.wait()
+        busy.reused_pid, busy.process = busy.process.pid, None
+        spawned = []
+        self.stubs.Set(self.shards, '_spawn', spawned.append)
+        self.shards.revive(busy)
+        self.assertEqual([busy], spawned)
+
+    def test_running_reused_hypervisor_is_kept(self):
+        idle = self.shards.shards[1]
+        process, idle.process = idle.process, None
+        idle.reused_pid = process.pid
+        self.stubs.Set(self.shards, '_spawn', self.fail)
+        self.shards.revive(idle)
+        idle.process = process
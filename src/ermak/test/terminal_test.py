@@ -0,0 +1,44 @@
+import unittest
+
+from ermak.ajaxterm.terminal import Terminal
+from ermak.util.telnet import TelnetFilter, escape
+
+
+class TerminalTest(unittest.TestCase):
+
+    def test_lines_scroll(self):
+        term = Terminal(10, 2)
+        term.write('one\r\ntwo\r\nthree')
+        self.assertEqual('two\nthree', term.text())
+
+    def test_cursor_and_erase(self):
+        term = Terminal(10, 3)
+        term.write('garbage\x1b[2J\x1b[2;3Hab\x08c\x1b[1;1Hxyz\x1b[1D\x1b[K')
+        self.assertEqual('xy\n  ac\n', term.text())
+
+    def test_escape_split_between_writes(self):
+        term = Terminal(10, 2)
+        term.write('abc\x1b[')
+        term.write('2Dd')
+        self.assertEqual('adc\n', term.text())
+
+    def test_dump_escapes_html(self):
+        term = Terminal(10, 1)
+        term.write('<R1>')
+        self.assertIn('&lt;R1&gt;', term.dump_html())
+
+
+class TelnetTest(unittest.TestCase):
+
+    def test_commands_are_stripped(self):
+        stream = TelnetFilter()
+        data = stream.feed('\xff\xfb\x01\xff\xfb')
+        data += stream.feed('\x03Router\xff\xff>\xff\xfa\x18\x01\xff\xf0')
+        self.assertEqual('Router\xff>', data)
+
+    def test_escape(self):
+        self.assertEqual('a\xff\xffb', escape('a\xffb'))
+
+
+if __name__ == '__main__':
+    unittest.main()
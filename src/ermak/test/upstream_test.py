@@ -0,0 +1,95 @@
+import socket
+import unittest
+
+import eventlet
+from eventlet import wsgi
+from eventlet.green import httplib
+
+from ermak.ajaxterm.upstream import UpstreamPool
+
+
+class NullLog(object):
+
+    def write(self, data):
+        pass
+
+
+class UpstreamPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.connections = set()
+        self.bodies = []
+        self.sock = eventlet.listen(('127.0.0.1', 0))
+        self.server = eventlet.spawn(wsgi.server, self.sock, self._app,
+                                     log=NullLog())
+        self.port = self.sock.getsockname()[1]
+        self.pool = UpstreamPool()
+
+    def tearDown(self):
+        self.server.kill()
+
+    def _app(self, environ, start_response):
+        self.connections.add(environ['REMOTE_PORT'])
+        body = environ['wsgi.input'].read() or environ['PATH_INFO']
+        self.bodies.append(body)
+        start_response('201 Created', [('Content-Type', 'text/plain'),
+                                       ('X-Echo', '1')])
+        return [body * 1000]
+
+    def test_connection_is_reused(self):
+        for path in ('/one', '/two'):
+            status, headers, body = self.pool.request(
+                '127.0.0.1', self.port, 'GET', path)
+            self.assertEqual('201 Created', status)
+            self.assertIn(('x-echo', '1'), headers)
+            self.assertEqual(path * 1000, ''.join(body))
+        self.assertEqual(1, len(self.connections))
+        stats = self.pool.stats_dict()['127.0.0.1:%d' % self.port]
+        self.assertEqual(2, stats['requests'])
+        self.assertEqual(1, stats['reused'])
+
+    def test_body_is_streamed_in_chunks(self):
+        status, headers, body = self.pool.request(
+            '127.0.0.1', self.port, 'POST', '/', 'x' * 100)
+        chunks = list(body)
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(100000, sum(len(c) for c in chunks))
+
+    def test_connection_closed_by_upstream_is_not_reused(self):
+        status, headers, body = self.pool.request(
+            '127.0.0.1', self.port, 'GET', '/one')
+        ''.join(body)
+        conn = self.pool._idle[('127.0.0.1', self.port)][0]
+        # as upstream closing idle connection looks to proxy
+        conn.sock.shutdown(socket.SHUT_RD)
+        status, headers, body = self.pool.request(
+            '127.0.0.1', self.port, 'POST', '/', 'keys')
+        self.assertEqual('keys' * 1000, ''.join(body))
+        self.assertEqual(['/one', 'keys'], self.bodies)
+
+    def test_post_is_not_retried(self):
+        posts = []
+
+        class BrokenConnection(object):
+            sock = object()
+
+            def request(self, *args):
+                posts.append(args)
+
+            def getresponse(self):
+                raise httplib.BadStatusLine('')
+
+            def close(self):
+                pass
+
+        upstream = ('127.0.0.1', self.port)
+        self.pool._get = lambda upstream: (BrokenConnection(), True)
+        self.assertRaises(httplib.HTTPException, self.pool.request,
+                          '127.0.0.1', self.port, 'POST', '/', 'keys')
+        self.assertEqual(1, len(posts))
+        self.assertEqual(1, self.pool.stats_dict()[
+            '%s:%s' % upstream]['errors'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import eventlet
+import unittest
+
+from ermak.compute import warmpool
+from ermak.compute.warmpool import WarmPool, WarmSpec, has_adapters
+
+
+class NM_1FE_TX(object):
+    pass
+
+
+class NM_4T(object):
+    pass
+
+
+class FakeRouter(object):
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.slot = [None] * 7
+        for slot_id, model in spec.adapters.iteritems():
+            self.slot[slot_id] = globals()[model.replace('-', '_')]()
+
+
+class WarmSpecTest(unittest.TestCase):
+
+    def test_parse(self):
+        spec = WarmSpec.parse('c1.3640:img:2', lambda flavor: 128)
+        self.assertEqual(('c1.3640', 'img', 2, 128, {}),
+                         (spec.flavor, spec.image_ref, spec.count, spec.ram,
+                          spec.adapters))
+
+    def test_parse_adapters(self):
+        spec = WarmSpec.parse('c1.3640:img:2:1=NM-1FE-TX,2=NM-4T',
+                              lambda flavor: 128)
+        self.assertEqual(('c1.3640', 'img', 2), (spec.flavor, spec.image_ref,
+                                                 spec.count))
+        self.assertEqual({1: 'NM-1FE-TX', 2: 'NM-4T'}, spec.adapters)
+
+
+class WarmPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.specs = [
+            WarmSpec('c1.3640', 'img', 1, 128),
+            WarmSpec('c1.3640', 'img', 1, 128, {1: 'NM-1FE-TX'})]
+        self.pool = WarmPool(self.specs, FakeRouter, 1024)
+        self.pool.start()
+        eventlet.sleep(0)
+
+    def test_refill_fills_all_specs(self):
+        self.assertEqual(2, len(self.pool))
+        self.assertEqual(256, self.pool.ram_used())
+
+    def test_claim_with_adapters_hits(self):
+        slots = {1: 'NM-1FE-TX'}
+        r = self.pool.claim('c1.3640', 'img',
+                            lambda r: has_adapters(r, slots))
+        self.assertTrue(r is not None)
+        self.assertEqual(self.specs[1], r.spec)
+        self.assertEqual({'ready': 1, 'ram_mb': 128, 'hits': 1, 'misses': 0},
+                         self.pool.stats())
+
+    def test_claim_of_missing_adapter_misses(self):
+        slots = {2: 'NM-4T'}
+        r = self.pool.claim('c1.3640', 'img',
+                            lambda r: has_adapters(r, slots))
+        self.assertEqual(None, r)
+        self.assertEqual(1, self.pool.misses)
+
+    def test_forget(self):
+        self.pool.forget(lambda r: r.spec.adapters)
+        self.assertEqual(1, len(self.pool))
+
+    def test_miss_refills_pool(self):
+        self.pool.forget(lambda r: True)
+        self.pool.claim('c1.3640', 'img')
+        eventlet.sleep(0)
+        self.assertEqual(2, len(self.pool))
+
+    def test_failed_create_is_retried(self):
+        failures = [IOError("hypervisor is busy")] * 2
+
+        def create(spec):
+            if failures:
+                raise failures.pop()
+            return FakeRouter(spec)
+
+        old_retry = warmpool.MIN_RETRY
+        warmpool.MIN_RETRY = 0.01
+        try:
+            pool = WarmPool(self.specs, create, 1024)
+            pool.start()
+            eventlet.sleep(0.1)
+        finally:
+            warmpool.MIN_RETRY = old_retry
+        self.assertEqual(2, len(pool))
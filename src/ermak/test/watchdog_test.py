@@ -0,0 +1,60 @@
+import eventlet
+import unittest
+
+from ermak.compute.watchdog import HypervisorWatchdog
+from ermak.test.fake_dynamips import FakeHypervisor
+from ermak.util.dynamips import DynamipsClient
+
+
+class FakeShard(object):
+
+    def __init__(self, index, client):
+        self.index = index
+        self.client = client
+
+
+class HypervisorWatchdogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hypervisor = FakeHypervisor().start()
+        self.hypervisor.add_vm('R1')
+        client = DynamipsClient(self.hypervisor.host, self.hypervisor.port,
+                                timeout=5, pool_size=2,
+                                reconnect_deadline=5)
+        self.shard = FakeShard(0, client)
+        self.revived = []
+        self.recovered = []
+        self.watchdog = HypervisorWatchdog(
+            [self.shard], 0.05, 0.1, self.revived.append, self._recovered)
+
+    def tearDown(self):
+        self.watchdog.stop()
+        self.shard.client.close_connections()
+        self.hypervisor.hung = False
+        self.hypervisor.stop()
+
+    def _recovered(self, shard):
+        # sent while other commands are held
+        self.recovered.append(shard.client.vm_list())
+
+    def test_healthy_hypervisor_is_left_alone(self):
+        self.watchdog.check_all()
+        self.watchdog.check_all()
+        self.assertEqual(0, self.watchdog.failures)
+        self.assertTrue(self.shard.client.online)
+
+    def test_hung_hypervisor_is_reconnected(self):
+        self.watchdog.start()
+        self.hypervisor.hung = True
+        eventlet.sleep(0.3)
+        self.assertFalse(self.shard.client.online)
+        self.assertTrue(self.revived)
+        # held until the hypervisor is back instead of failing
+        thread = eventlet.spawn(self.shard.client.call, 'vm start R1')
+        eventlet.sleep(0.1)
+        self.hypervisor.hung = False
+        self.assertEqual(["100-VM 'R1' started"], thread.wait())
+        self.assertEqual([['R1']], self.recovered)
+        self.assertTrue(self.shard.client.online)
+        self.assertEqual({'failures': 1, 'reconnects': 1, 'recovering': 0},
+                         self.watchdog.stats())
@@ -0,0 +1,44 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    """
+    Least recently used cache of at most max_size entries, each expiring
+    ttl seconds after it was set.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def _lookup(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            return None
+        self._entries[key] = entry
+        return entry
+
+    def get(self, key, default=None):
+        entry = self._lookup(key)
+        return default if entry is None else entry[1]
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        self._entries.pop(key, None)
+        self._entries[key] = (time.time() + ttl, value)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
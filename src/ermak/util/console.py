@@ -0,0 +1,143 @@
+"""Persistent taps on router console ports."""
+
+import socket
+
+import eventlet
+
+from nova.openstack.common import log as logging
+
+from ermak.util import telnet
+
+LOG = logging.getLogger("nova.virt.dynamips.console")
+
+MIN_RETRY = 0.5
+MAX_RETRY = 5.0
+
+
+class RingBuffer(object):
+    """Last size bytes written, kept in preallocated bytearray"""
+
+    def __init__(self, size):
+        self.size = size
+        self._data = bytearray(size)
+        self._pos = 0
+        self._full = False
+
+    def write(self, data):
+        if not self.size:
+            return
+        if len(data) >= self.size:
+            self._data[:] = data[-self.size:]
+            self._pos = 0
+            self._full = True
+            return
+        end = self._pos + len(data)
+        if end <= self.size:
+            self._data[self._pos:end] = data
+        else:
+            split = self.size - self._pos
+            self._data[self._pos:] = data[:split]
+            self._data[:end - self.size] = data[split:]
+        if end >= self.size:
+            self._full = True
+        self._pos = end % self.size
+
+    def read(self):
+        if not self._full:
+            return str(self._data[:self._pos])
+        return str(self._data[self._pos:] + self._data[:self._pos])
+
+
+class ConsoleTap(object):
+    """
+    Connection to router console kept open for router lifetime.
+
+    Console output goes into ring buffer of fixed size and to
+    subscribed listeners; input of interactive sessions is sent through
+    the same connection. When console closes, as it does on router stop,
+    the tap reconnects in background.
+    """
+
+    def __init__(self, host, port, size):
+        self.host = host
+        self.port = port
+        self.buffer = RingBuffer(size)
+        self._listeners = []
+        self._sock = None
+        self._thread = None
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = eventlet.spawn(self._run)
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.kill()
+            self._thread = None
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _run(self):
+        delay = MIN_RETRY
+        while True:
+            try:
+                sock = eventlet.connect((self.host, self.port))
+            except socket.error:
+                eventlet.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY)
+                continue
+            delay = MIN_RETRY
+            self._sock = sock
+            try:
+                self._read(sock)
+            finally:
+                self._sock = None
+                sock.close()
+            eventlet.sleep(delay)
+
+    def _read(self, sock):
+        stream = telnet.TelnetFilter()
+        try:
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    return
+                data = stream.feed(data)
+                if data:
+                    self.buffer.write(data)
+                    self._notify(data)
+        except socket.error:
+            pass
+
+    def _notify(self, data):
+        for listener in list(self._listeners):
+            try:
+                listener(data)
+            except Exception:
+                LOG.exception("Console listener failed")
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def send(self, data):
+        """Send input to console, False if it is not connected"""
+        sock = self._sock
+        if sock is None:
+            return False
+        try:
+            sock.sendall(telnet.escape(data))
+            return True
+        except socket.error:
+            return False
+
+    def output(self):
+        return self.buffer.read()
@@ -1,40 +1,384 @@
+import contextlib
+import time
+
+import eventlet
+from eventlet import corolocal
+from eventlet import event
+from eventlet import queue
+from eventlet.green import socket
+
 from dynagen import dynamips_lib
-from dynagen.dynamips_lib import send
-from threading import Lock
+from dynagen.dynamips_lib import DynamipsError
+
+from ermak.util.metrics import METRICS
 
 """Monkey patch for dynamips_lib"""
-legacy_send = send
+legacy_send = dynamips_lib.send
+
+# commands which may legitimately take longer than the default timeout
+COMMAND_TIMEOUTS = {
+    'vm start': 300,
+    'vm stop': 120,
+    'vm delete': 120,
+    'vm get_idle_pc_prop': 300,
+}
+
+
+def command_verb(command):
+    """Module and command name, e.g. 'vm set_ram' for 'vm set_ram R1 128'"""
+    return ' '.join(command.split(None, 2)[:2])
+
+
+def rollback_commands(commands, replies):
+    """
+    Commands undoing what succeeded of a batch: VMs created by it are
+    deleted with everything bound to them, then NIOs and bindings added
+    to other VMs are removed in reverse order.
+    """
+    done = [command.split() for command, reply in zip(commands, replies)
+            if not isinstance(reply, DynamipsError)]
+    created = set(words[2] for words in done
+                  if words[:2] == ['vm', 'create'])
+    undo = ['vm delete %s' % name for name in sorted(created)]
+    for words in reversed(done):
+        verb = ' '.join(words[:2])
+        if verb == 'nio create_udp':
+            undo.append('nio delete %s' % words[2])
+        elif words[2:3] and words[2] in created:
+            continue
+        elif verb == 'vm slot_add_nio_binding':
+            undo.append('vm slot_remove_nio_binding %s' % ' '.join(words[2:5]))
+        elif verb == 'vm slot_add_binding':
+            undo.append('vm slot_remove_binding %s' % ' '.join(words[2:5]))
+    return undo
+
+
+class HypervisorConnection(object):
+    """
+    Connection to dynamips hypervisor using cooperative sockets,
+    so waiting for reply does not block other green threads.
+    """
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self._sock = None
+        self._buf = ''
+        self.generation = 0
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def connect(self):
+        self.close()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect((self.host, self.port))
+        except socket.error as e:
+            sock.close()
+            raise DynamipsError('Could not connect to server: %s' % e)
+        self._sock = sock
+        self._buf = ''
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def send(self, command, timeout=None):
+        """
+        Send command and wait for its reply
+
+        :return list of reply lines, including final status line
+        """
+        reply = self.send_many([command], timeout)[0]
+        if isinstance(reply, DynamipsError):
+            raise reply
+        return reply
+
+    def send_many(self, commands, timeout=None):
+        """
+        Pipeline commands: send them at once, then read replies in order.
+        Hypervisor executes commands of one connection sequentially, so
+        time between replies is what each command took.
+
+        :return list of replies, error replies given as DynamipsError
+        """
+        if not self.connected:
+            self.connect()
+        self._sock.settimeout(timeout or self.timeout)
+        try:
+            self._sock.sendall(
+                ''.join(command.strip() + '\n' for command in commands))
+            replies = []
+            last = time.time()
+            for command in commands:
+                try:
+                    replies.append(self._read_reply())
+                except DynamipsError as e:
+                    replies.append(e)
+                now = time.time()
+                METRICS.observe('dynamips.' + command_verb(command),
+                                now - last)
+                last = now
+            return replies
+        except socket.timeout:
+            # late reply would be taken for the next command's one
+            self.close()
+            raise DynamipsError(
+                'Timed out waiting for reply to %r' % commands[0])
+        except socket.error as e:
+            self.close()
+            raise DynamipsError(
+                'Lost connection to %s:%s: %s' % (self.host, self.port, e))
 
+    def _read_line(self):
+        while '\n' not in self._buf:
+            chunk = self._sock.recv(4096)
+            if not chunk:
+                raise socket.error('connection closed by hypervisor')
+            self._buf += chunk
+        line, self._buf = self._buf.split('\n', 1)
+        return line.rstrip('\r')
 
-def locking_send(dynamips, data):  # TODO: green threads
-    try:
-        dynamips.sock_mutex.acquire()
+    def _read_reply(self):
+        # reply lines are "CODE-text" for final and "CODE text" for
+        # intermediate ones; codes 2xx are errors
+        lines = []
+        while True:
+            line = self._read_line()
+            lines.append(line)
+            if len(line) > 3 and line[3] == '-':
+                break
+        if lines[-1][0] == '2':
+            raise DynamipsError(lines[-1])
+        return lines
+
+
+def green_send(dynamips, data):
+    if dynamips_lib.NOSEND or not isinstance(dynamips, DynamipsClient):
         return legacy_send(dynamips, data)
-    finally:
-        dynamips.sock_mutex.release()
+    deferred = dynamips.deferred_commands
+    if deferred is not None:
+        deferred.append(data)
+        return ['100-OK']
+    return dynamips.call(data)
 
 
-send = locking_send
-dynamips_lib.send = locking_send
+send = green_send
+dynamips_lib.send = green_send
 
 
 class DynamipsClient(dynamips_lib.Dynamips):
+    """
+    While hypervisor is down (see mark_down), commands wait for it to
+    come back for at most reconnect_deadline seconds instead of failing
+    at once; those of the green thread recovering it are sent as usual.
+    """
 
-    def __init__(self, host, port=7200, timeout=500):
+    def __init__(self, host, port=7200, timeout=500, pool_size=1,
+                 reconnect_deadline=0):
         old_nosend = dynamips_lib.NOSEND
         dynamips_lib.NOSEND = True
-        self.sock_mutex = Lock()
         super(DynamipsClient, self).__init__(host, port, timeout)
         dynamips_lib.NOSEND = old_nosend
+        self._address = (host, port, timeout)
+        self._pool = queue.LightQueue()
+        self._pool_slots = pool_size
+        self._connections = []
+        self._local = corolocal.local()
+        self.reconnect_deadline = reconnect_deadline
+        self._generation = 0
+        self._recovered = None
+        self._recovering_thread = None
+        self._probe = HypervisorConnection(host, port, timeout)
         if not dynamips_lib.NOSEND:
-            self.s.setblocking(1)
-            try:
-                self.s.connect((host, port))
-            except:
-                raise dynamips_lib.DynamipsError('Could not connect to server')
+            # fail early if hypervisor is unreachable
+            self._pool.put(self._new_connection())
+
+    def _new_connection(self):
+        # slot is taken before connect, which yields to other threads
+        self._pool_slots -= 1
+        conn = HypervisorConnection(*self._address)
+        conn.generation = self._generation
+        try:
+            conn.connect()
+        except Exception:
+            self._pool_slots += 1
+            raise
+        self._connections.append(conn)
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self):
+        if self._pool.empty() and self._pool_slots > 0:
+            conn = self._new_connection()
+        else:
+            started = time.time()
+            conn = self._pool.get()
+            METRICS.observe('dynamips.pool_wait', time.time() - started)
+        if conn.generation != self._generation:
+            # opened before hypervisor went down, reconnects on next send
+            conn.close()
+            conn.generation = self._generation
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close_connections(self):
+        for conn in self._connections:
+            conn.close()
+        self._probe.close()
+
+    @property
+    def online(self):
+        return self._recovered is None
+
+    def probe(self, timeout):
+        """
+        Send keepalive on connection of its own, so it is not queued
+        behind slow commands; raise DynamipsError if there is no reply
+        within timeout seconds
+        """
+        return self._probe.send('hypervisor version', timeout)
+
+    def mark_down(self):
+        """
+        Hold commands of other green threads until mark_up, and drop
+        connections opened so far, as hypervisor is dead or hung
+        """
+        if self._recovered is None:
+            self._recovered = event.Event()
+        self._recovering_thread = eventlet.getcurrent()
+        self._generation += 1
+        self._probe.close()
+
+    def mark_up(self):
+        recovered, self._recovered = self._recovered, None
+        self._recovering_thread = None
+        if recovered is not None:
+            recovered.send()
+
+    def wait_online(self, deadline=None):
+        """
+        Wait at most deadline seconds, reconnect_deadline by default, for
+        hypervisor to be back; with deadline 0 fail at once if it is down
+        """
+        recovered = self._recovered
+        if recovered is None or \
+                eventlet.getcurrent() is self._recovering_thread:
+            return
+        if deadline is None:
+            deadline = self.reconnect_deadline
+        if deadline > 0:
+            with eventlet.Timeout(deadline, False):
+                recovered.wait()
+                return
+        raise DynamipsError('Hypervisor %s:%s is not back after %s s' % (
+            self.host, self.port, deadline))
+
+    def call(self, command, timeout=None):
+        """Send raw command, waiting at most timeout seconds for reply"""
+        if timeout is None:
+            timeout = COMMAND_TIMEOUTS.get(command_verb(command))
+        dynamips_lib.debug('sending to %s:%s -> %s' % (
+            self.host, self.port, command))
+        self.wait_online()
+        with self._connection() as conn:
+            return conn.send(command, timeout)
+
+    def call_many(self, commands, timeout=None, raise_errors=True):
+        """
+        Pipeline raw commands on one connection
+
+        :return list of replies; with raise_errors=False error replies
+                are returned as DynamipsError instances
+        """
+        if not commands:
+            return []
+        if timeout is None:
+            timeout = max(COMMAND_TIMEOUTS.get(command_verb(c), 0)
+                          for c in commands) or None
+        dynamips_lib.debug('sending to %s:%s -> %s' % (
+            self.host, self.port, commands))
+        self.wait_online()
+        with self._connection() as conn:
+            replies = conn.send_many(commands, timeout)
+        if raise_errors:
+            for reply in replies:
+                if isinstance(reply, DynamipsError):
+                    raise reply
+        return replies
+
+    @property
+    def deferred_commands(self):
+        return getattr(self._local, 'deferred', None)
+
+    @contextlib.contextmanager
+    def deferred(self):
+        """
+        Queue commands sent by dynagen objects from current green thread
+        and pipeline them on flush or exit, instead of a round-trip per
+        command. Deferred commands get fake OK replies, so only those
+        whose reply is not used may be sent this way.
+        """
+        if self.deferred_commands is not None:
+            yield
+            return
+        self._local.deferred = []
+        try:
+            yield
+            self.flush()
+        finally:
+            self._local.deferred = None
+
+    def flush(self):
+        """
+        Send deferred commands as one batch. If any of them fails, what
+        the others did is rolled back and the first error is raised, so
+        no half-built router is left on the hypervisor.
+        """
+        commands = self.deferred_commands
+        if not commands:
+            return
+        self._local.deferred = []
+        try:
+            replies = self.call_many(commands, raise_errors=False)
+        except DynamipsError as e:
+            # timed out or connection lost, any command may have been done
+            self._rollback(commands, [None] * len(commands))
+            raise e
+        errors = [r for r in replies if isinstance(r, DynamipsError)]
+        if errors:
+            self._rollback(commands, replies)
+            raise errors[0]
+
+    def _rollback(self, commands, replies):
+        undo = rollback_commands(commands, replies)
+        dynamips_lib.debug('rolling back on %s:%s -> %s' % (
+            self.host, self.port, undo))
+        try:
+            self.call_many(undo, raise_errors=False)
+        except DynamipsError:
+            dynamips_lib.debug('rollback on %s:%s failed' % (
+                self.host, self.port))
 
     def vm_list(self):
-        map(lambda x: x.split()[1], self.list("vm"))
+        """Names of all VMs of the hypervisor"""
+        # reply lines are "101 R1 (id 1, type c7200)" and final "100-OK"
+        return [line.split()[1] for line in self.call('vm list')
+                if line.startswith('101 ')]
+
+    def nio_list(self):
+        """Names of all NIOs of the hypervisor"""
+        # reply lines are "101 nio_udp_1_0_0" and final "100-OK"
+        return [line.split()[1] for line in self.call('nio list')
+                if line.startswith('101 ')]
 
 
 class Bridge(dynamips_lib.Bridge):
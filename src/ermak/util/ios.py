@@ -0,0 +1,31 @@
+import os
+import shutil
+import zipfile
+
+
+def is_compressed(path):
+    """
+    Compressed IOS images are ELF loaders with the real image packed in
+    a zip archive appended to them.
+    """
+    return zipfile.is_zipfile(path)
+
+
+def unpack(path, target):
+    """
+    Write uncompressed image from compressed IOS image at path to target
+
+    :return False if the image is not compressed
+    """
+    if not is_compressed(path):
+        return False
+    archive = zipfile.ZipFile(path)
+    try:
+        member = max(archive.infolist(), key=lambda i: i.file_size)
+        part = target + '.part'
+        with open(part, 'wb') as f:
+            shutil.copyfileobj(archive.open(member), f, 1024 * 1024)
+        os.rename(part, target)
+    finally:
+        archive.close()
+    return True
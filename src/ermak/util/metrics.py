@@ -0,0 +1,92 @@
+"""Latency histograms cheap enough to keep on in production."""
+
+import bisect
+import contextlib
+import json
+import os
+import signal
+import time
+from collections import defaultdict
+
+# bucket upper bounds in seconds: 0.1 ms doubling up to ~105 s
+BOUNDS = [0.0001 * 2 ** i for i in xrange(21)]
+
+
+class Histogram(object):
+    """Count of observed durations in log-spaced buckets"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        """Upper bound of bucket holding p-th percentile"""
+        if not self.count:
+            return 0.0
+        rank = self.count * p / 100.0
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return BOUNDS[i] if i < len(BOUNDS) else self.max
+        return self.max
+
+    def as_dict(self):
+        return {'count': self.count,
+                'avg_ms': self.total / self.count * 1000
+                if self.count else 0.0,
+                'p50_ms': self.percentile(50) * 1000,
+                'p99_ms': self.percentile(99) * 1000,
+                'max_ms': self.max * 1000}
+
+
+class Metrics(object):
+    """Histograms by name, e.g. 'dynamips.vm start' or 'spawn.image'"""
+
+    def __init__(self):
+        self.histograms = defaultdict(Histogram)
+        self._sources = {}
+
+    def add_source(self, name, stats):
+        """Dump stats() dict under name along with histograms"""
+        self._sources[name] = stats
+
+    def observe(self, name, seconds):
+        self.histograms[name].add(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.histograms[name].add(time.time() - started)
+
+    def dump(self):
+        dump = dict((name, h.as_dict())
+                    for name, h in self.histograms.iteritems())
+        for name, stats in self._sources.iteritems():
+            dump[name] = stats()
+        return dump
+
+    def write(self, path):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.dump(), f, indent=1, sort_keys=True)
+        os.rename(tmp, path)
+
+    def dump_on_signal(self, path, signum=signal.SIGUSR2):
+        """Write dump as JSON to path whenever signum is received"""
+        signal.signal(signum, lambda signum, frame: self.write(path))
+
+
+METRICS = Metrics()
@@ -0,0 +1,50 @@
+"""Telnet protocol bits needed to talk to dynamips consoles."""
+
+IAC = '\xff'
+SB = '\xfa'
+SE = '\xf0'
+OPTION_COMMANDS = '\xfb\xfc\xfd\xfe'  # WILL, WONT, DO, DONT
+
+
+class TelnetFilter(object):
+    """
+    Strips telnet commands from console output. Keeps state between
+    chunks, so commands split across reads are handled.
+    """
+
+    def __init__(self):
+        self._state = None
+
+    def feed(self, data):
+        out = []
+        state = self._state
+        for ch in data:
+            if state is None:
+                if ch == IAC:
+                    state = 'iac'
+                else:
+                    out.append(ch)
+            elif state == 'iac':
+                if ch == IAC:
+                    out.append(ch)
+                    state = None
+                elif ch in OPTION_COMMANDS:
+                    state = 'option'
+                elif ch == SB:
+                    state = 'sb'
+                else:
+                    state = None
+            elif state == 'option':
+                state = None
+            elif state == 'sb':
+                if ch == IAC:
+                    state = 'sb-iac'
+            elif state == 'sb-iac':
+                state = None if ch == SE else 'sb'
+        self._state = state
+        return ''.join(out)
+
+
+def escape(data):
+    """Escape user input for sending over telnet"""
+    return data.replace(IAC, IAC + IAC)